@@ -1,115 +1,749 @@
+import os
+import time
+import threading
 import cv2
 import numpy as np
-import pytesseract
-from PIL import Image
-import torch
+from functools import lru_cache
+from ocr_cache import get_cache, hash_array, hash_bytes, hash_file, make_key
+from handwriting import get_trocr_engine
+from instrumentation import span
 
-# pytesseract: A Python wrapper for Tesseract, an OCR (Optical Character Recognition) engine that extracts text from images.
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# printed text pipeline settings, these are also part of the OCR cache key
+TESSERACT_CONFIG = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
+PREPROCESS_PARAMS = {
+    'clahe_clip_limit': 3.0,
+    'clahe_tile_grid': (8, 8),
+    'open_kernel': (1, 1),
+}
 
+# adaptive preprocessing (preprocess_adaptive): thresholds the planner decides with
+ADAPTIVE_PARAMS = {
+    'downscale_min_pixels': 4_000_000,  # smaller pages are never downscaled
+    'max_char_height': 64,              # characters taller than this (px) get the page downscaled...
+    'target_char_height': 32,           # ...to about this height, plenty for tesseract
+    'binary_fraction': 0.98,            # share of pixels in the darkest / brightest bins of a binary scan
+}
+# OCR_ADAPTIVE=1 makes process_and_extract use the adaptive pipeline
+ADAPTIVE_PREPROCESS = os.environ.get('OCR_ADAPTIVE') == '1'
+
+
+def _parse_tesseract_config(config):
+    """Split a tesseract CLI config string into lang / oem / psm and -c variables."""
+    options = {'lang': 'eng', 'oem': None, 'psm': None, 'variables': {}}
+    tokens = config.split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token == '--oem':
+            options['oem'] = int(value)
+        elif token == '--psm':
+            options['psm'] = int(value)
+        elif token == '-l':
+            options['lang'] = value
+        elif token == '-c' and value and '=' in value:
+            name, _, setting = value.partition('=')
+            options['variables'][name] = setting
+        else:
+            i += 1
+            continue
+        i += 2
+    return options
+
+
+class PytesseractEngine:
+    """
+    Fallback engine: one tesseract subprocess per call through pytesseract.
+
+    Every engine offers image_to_string(image, config) and
+    image_to_data(image, config), the latter returning a list of word dicts
+    (text, left, top, width, height, conf, line) in reading order; line
+    numbers the text line a word belongs to.
+    """
+    name = 'pytesseract'
+
+    def __init__(self):
+        # imported here, runs that go through tesserocr never pay for it
+        # pytesseract: A Python wrapper for Tesseract, an OCR (Optical Character Recognition) engine that extracts text from images.
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+        self._pytesseract = pytesseract
+
+    def version(self):
+        return f"{self.name} {self._pytesseract.get_tesseract_version()}"
+
+    def image_to_string(self, image, config=''):
+        return self._pytesseract.image_to_string(image, config=config)
+
+    def image_to_data(self, image, config=''):
+        pytesseract = self._pytesseract
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        words = []
+        line, last_line_id = -1, None
+        for i, text in enumerate(data['text']):
+            if not text.strip() or float(data['conf'][i]) < 0:
+                continue
+            line_id = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            if line_id != last_line_id:
+                line, last_line_id = line + 1, line_id
+            words.append({'text': text, 'left': data['left'][i], 'top': data['top'][i],
+                          'width': data['width'][i], 'height': data['height'][i],
+                          'conf': float(data['conf'][i]), 'line': line})
+        return words
+
+
+class TesserocrEngine:
+    """
+    Long-lived libtesseract handles through tesserocr. Each thread keeps one
+    initialised API per config, so language data is loaded once and numpy
+    arrays are handed over as raw bytes without a temp PNG.
+    """
+    name = 'tesserocr'
+
+    def __init__(self, tesserocr_module):
+        self._tesserocr = tesserocr_module
+        self._local = threading.local()
+
+    def version(self):
+        return f"{self.name} {self._tesserocr.tesseract_version().splitlines()[0]}"
+
+    def _api(self, config):
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get(config)
+        if api is None:
+            options = _parse_tesseract_config(config)
+            kwargs = {'lang': options['lang']}
+            if options['oem'] is not None:
+                kwargs['oem'] = options['oem']
+            if options['psm'] is not None:
+                kwargs['psm'] = options['psm']
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            for name, setting in options['variables'].items():
+                api.SetVariable(name, setting)
+            apis[config] = api
+        return api
+
+    def _set_image(self, api, image):
+        if not isinstance(image, np.ndarray):
+            # PIL image
+            api.SetImage(image)
+            return
+        image = np.ascontiguousarray(image)
+        if image.ndim == 3:
+            # opencv arrays are BGR(A), tesseract wants RGB(A)
+            code = cv2.COLOR_BGRA2RGBA if image.shape[2] == 4 else cv2.COLOR_BGR2RGB
+            image = cv2.cvtColor(image, code)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+
+    def image_to_string(self, image, config=''):
+        api = self._api(config)
+        self._set_image(api, image)
+        return api.GetUTF8Text()
+
+    def image_to_data(self, image, config=''):
+        api = self._api(config)
+        self._set_image(api, image)
+        api.Recognize()
+        words = []
+        iterator = api.GetIterator()
+        if iterator is None:
+            return words
+        level = self._tesserocr.RIL.WORD
+        line = -1
+        for word in self._tesserocr.iterate_level(iterator, level):
+            if line < 0 or word.IsAtBeginningOf(self._tesserocr.RIL.TEXTLINE):
+                line += 1
+            text = word.GetUTF8Text(level)
+            box = word.BoundingBox(level)
+            if not text or not text.strip() or box is None:
+                continue
+            x1, y1, x2, y2 = box
+            words.append({'text': text, 'left': x1, 'top': y1, 'width': x2 - x1,
+                          'height': y2 - y1, 'conf': word.Confidence(level), 'line': line})
+        return words
+
+
+# OCR engines by name, each created on first use. register_engine() plugs in more.
+_engine_factories = {}
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def register_engine(name, factory):
+    """Make factory() available as get_engine(name); replaces an engine of the same name."""
+    with _engines_lock:
+        _engine_factories[name] = factory
+        _engines.pop(name, None)
+
+
+def get_engine(name):
+    """The process-wide instance of a registered engine. Raises ImportError if its library is missing."""
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                if name not in _engine_factories:
+                    raise ValueError(f"Unknown OCR engine '{name}'. Must be one of {sorted(_engine_factories)}.")
+                engine = _engines[name] = _engine_factories[name]()
+    return engine
+
+
+def _tesserocr_engine():
+    import tesserocr
+    return TesserocrEngine(tesserocr)
+
+
+register_engine('tesserocr', _tesserocr_engine)
+register_engine('pytesseract', PytesseractEngine)
+# line crops -> texts, the expensive engine the cascade escalates to
+register_engine('trocr', get_trocr_engine)
+
+_ocr_engine = None
+
+
+def get_ocr_engine():
+    """
+    Shared printed-text engine for this process, picked by OCR_ENGINE (default
+    tesserocr). Falls back to pytesseract when the library isn't installed.
+    Only page engines qualify: line recognisers like trocr lack image_to_string.
+    """
+    global _ocr_engine
+    if _ocr_engine is None:
+        name = os.environ.get('OCR_ENGINE', 'tesserocr')
+        try:
+            engine = get_engine(name)
+        except ImportError:
+            engine = get_engine('pytesseract')
+        if not all(hasattr(engine, method) for method in ('image_to_string', 'image_to_data')):
+            raise ValueError(f"OCR engine '{name}' can't read whole pages, pick tesserocr or pytesseract.")
+        _ocr_engine = engine
+    return _ocr_engine
+
+
+@lru_cache(maxsize=None)
+def tesseract_version():
+    try:
+        return get_ocr_engine().version()
+    except Exception:
+        return "unknown"
+
+
+def _size_fields(image):
+    # span fields for numpy arrays and PIL images alike; PIL's size is (width, height)
+    shape = getattr(image, 'shape', None)
+    if shape is not None:
+        return {'height': shape[0], 'width': shape[1]}
+    size = getattr(image, 'size', None)
+    if isinstance(size, tuple):
+        return {'height': size[1], 'width': size[0]}
+    return {}
+
+
+def load_image(source):
+    """
+    BGR image from a file path, from encoded image bytes (an upload, a file read
+    into memory) or from an already decoded numpy array. None if it can't be decoded.
+    """
+    if isinstance(source, np.ndarray):
+        return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR) if source.ndim == 2 else source
+    with span('decode') as sp:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = np.frombuffer(source, np.uint8)
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        else:
+            sp.set(path=str(source))
+            image = cv2.imread(source)
+        if image is not None:
+            sp.set(**_size_fields(image))
+    return image
+
+def read_source(source):
+    """
+    Load an image source exactly once. Returns (image, content_hash): the BGR
+    image and a hash of the original content for cache keys. A path is read
+    into memory and decoded from that buffer, so the file is only touched once.
+    """
+    if isinstance(source, np.ndarray):
+        image = load_image(source)
+        return image, hash_array(image)
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            with open(source, 'rb') as f:
+                source = f.read()
+        except OSError:
+            return None, None
+    return load_image(source), hash_bytes(source)
 
 # optical character recognition ocr works better on grayscale
 def preprocess_image(image_path):
-    image = cv2.imread(image_path)
+    image = load_image(image_path)
     if image is None:
         print("Could not load the image. Check the path!")
         return None, None, None
 
     # i need the grayscale image to later extract features
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    with span('grayscale'):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # contrast ko better karna hai via CLAHE (Contrast Limited Adaptive Histogram Equalization)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    gray = clahe.apply(gray)
+    with span('clahe'):
+        clahe = cv2.createCLAHE(clipLimit=PREPROCESS_PARAMS['clahe_clip_limit'],
+                                tileGridSize=PREPROCESS_PARAMS['clahe_tile_grid'])
+        gray = clahe.apply(gray)
 
     # Apply Otsu's thresholding
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    with span('otsu'):
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
     # Optional: clean up small noise with a morphological opening -> which removes small noise by first eroding and then dilating the image.
-    kernel = np.ones((1, 1), np.uint8)
-    cleaned = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+    cleaned = _open_noise(binary)
 
     # return the images 
     return gray, cleaned, image  
 
-def extract_text(image):
-    custom_config = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
+def _open_noise(binary):
+    # a 1x1 opening leaves the image as it is, don't pay a full pass for it
+    if tuple(PREPROCESS_PARAMS['open_kernel']) == (1, 1):
+        return binary
+    with span('morph_open'):
+        kernel = np.ones(PREPROCESS_PARAMS['open_kernel'], np.uint8)
+        return cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+
+def _estimate_char_height(gray):
+    # median height of the ink blobs on a ~1000px thumbnail, scaled back to the page
+    factor = min(1.0, 1000 / max(gray.shape))
+    small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    # specks, rulings and big pictures say nothing about the text size
+    heights = heights[(heights >= 2) & (heights < small.shape[0] // 4) & (stats[1:, cv2.CC_STAT_AREA] >= 4)]
+    if heights.size < 10:
+        return None
+    return float(np.median(heights)) / factor
+
+def plan_preprocessing(gray):
+    """
+    Decide which preprocessing stages a page needs from cheap statistics of its
+    grayscale image. Returns a dict: height, width, binary_input (already a
+    black / white scan), char_height (estimated, only for large pages), scale
+    (< 1 means downscale first) and stages, the stages that will run.
+    """
+    height, width = gray.shape
+    # a strided sample is plenty for the histogram of a big page
+    sample = gray[::4, ::4] if gray.size > 1_000_000 else gray
+    hist = np.bincount(sample.ravel(), minlength=256)
+    binary_input = bool(hist[:32].sum() + hist[224:].sum() >= ADAPTIVE_PARAMS['binary_fraction'] * sample.size)
+
+    char_height, scale = None, 1.0
+    if height * width > ADAPTIVE_PARAMS['downscale_min_pixels']:
+        char_height = _estimate_char_height(gray)
+        if char_height and char_height > ADAPTIVE_PARAMS['max_char_height']:
+            scale = ADAPTIVE_PARAMS['target_char_height'] / char_height
+
+    stages = ['grayscale']
+    if scale < 1:
+        stages.append('downscale')
+    if not binary_input:
+        stages.append('clahe')
+    stages.append('otsu')
+    if tuple(PREPROCESS_PARAMS['open_kernel']) != (1, 1):
+        stages.append('morph_open')
+    return {'height': height, 'width': width, 'binary_input': binary_input,
+            'char_height': char_height, 'scale': scale, 'stages': stages}
+
+def preprocess_adaptive(image_path):
+    """
+    preprocess_image with only the stages the page needs: oversized photos are
+    downscaled to a text size tesseract reads well, CLAHE is skipped on scans
+    that already are black and white. Returns (gray, cleaned, image, plan),
+    plan['stages'] lists what ran.
+    """
+    image = load_image(image_path)
+    if image is None:
+        print("Could not load the image. Check the path!")
+        return None, None, None, None
+
+    with span('grayscale'):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    with span('preprocess_plan') as sp:
+        plan = plan_preprocessing(gray)
+        sp.set(stages=','.join(plan['stages']), scale=plan['scale'])
+
+    if plan['scale'] < 1:
+        with span('downscale', scale=plan['scale']):
+            gray = cv2.resize(gray, None, fx=plan['scale'], fy=plan['scale'], interpolation=cv2.INTER_AREA)
+
+    if 'clahe' in plan['stages']:
+        with span('clahe'):
+            clahe = cv2.createCLAHE(clipLimit=PREPROCESS_PARAMS['clahe_clip_limit'],
+                                    tileGridSize=PREPROCESS_PARAMS['clahe_tile_grid'])
+            gray = clahe.apply(gray)
+
+    with span('otsu'):
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    return gray, _open_noise(binary), image, plan
+
+def extract_text(image, use_cache=True, raise_errors=False):
+    """
+    Tesseract text of a preprocessed image. use_cache=False skips the per-image
+    cache entry, for callers that already cache the result under their own key.
+    A failed OCR call returns "" (and is never cached), or raises with raise_errors=True.
+    """
+    custom_config = TESSERACT_CONFIG
     # hamhe configurations tessaract ko provide karni hai hence--->oem->ocr engine mode
     # page segmentation mode
     # preserve spaces between the word
-    try:
-        text = pytesseract.image_to_string(image, config=custom_config)
-        return text.strip()
-    except Exception as e:
-        print("Error during OCR:", e)
-        return ""
-
-def extract_handwritten_text_by_line(image_path):
-    try:
-        print(f"[INFO] Loading image: {image_path}")
-        image = cv2.imread(image_path)
-        if image is None:
-            print("[ERROR] Failed to load image.")
+    with span('tesseract', **_size_fields(image)) as sp:
+        cache = get_cache() if use_cache else None
+        key = make_key('text', hash_array(image), custom_config, tesseract_version()) if cache else None
+        if key:
+            cached = cache.get(key)
+            if cached is not None:
+                sp.set(cache_hit=True, chars=len(cached))
+                return cached
+        try:
+            text = get_ocr_engine().image_to_string(image, config=custom_config).strip()
+        except Exception as e:
+            sp.set(error=type(e).__name__)
+            if raise_errors:
+                raise
+            print("Error during OCR:", e)
             return ""
+        sp.set(cache_hit=False, chars=len(text))
+    if key:
+        cache.put(key, text)
+    return text
 
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+# line segmentation settings per document type, pick one with preset=... or pass a dict
+SEGMENTATION_PRESETS = {
+    # scanned / photographed handwriting pages
+    'default': {'remove_rules': True, 'smooth_rows': 1, 'min_ink': 0.04, 'min_gap': 1,
+                'min_height': 12, 'min_width': 50, 'pad': 4},
+    # photographed notebook pages with tight line spacing and background noise
+    'dense': {'remove_rules': True, 'smooth_rows': 1, 'min_ink': 0.08, 'min_gap': 0,
+              'min_height': 8, 'min_width': 40, 'pad': 2},
+    # plain paper / whiteboards, large writing with wide gaps between lines
+    'sparse': {'remove_rules': False, 'smooth_rows': 9, 'min_ink': 0.01, 'min_gap': 12,
+               'min_height': 25, 'min_width': 80, 'pad': 8},
+}
+
+def segmentation_params(preset='default'):
+    """
+    remove_rules -- drop long ruled / margin lines before building the profile
+    smooth_rows -- window (rows) used to smooth the horizontal projection profile
+    min_ink     -- fraction of the page width a row needs in ink to count as text
+    min_gap     -- blank bands up to this many rows are merged into the line
+    min_height, min_width -- smaller line boxes are dropped
+    pad         -- pixels added around every line box
+    """
+    if isinstance(preset, dict):
+        return {**SEGMENTATION_PRESETS['default'], **preset}
+    if preset not in SEGMENTATION_PRESETS:
+        raise ValueError(f"Unknown segmentation preset '{preset}'. Must be one of {sorted(SEGMENTATION_PRESETS)}.")
+    return dict(SEGMENTATION_PRESETS[preset])
 
-        # Dilate to connect characters into lines
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 5))
-        dilated = cv2.dilate(thresh, kernel, iterations=2)
+def segment_handwritten_lines(image, preset='default'):
+    """Bounding boxes (x, y, w, h) of the text lines in a BGR image, top to bottom."""
+    with span('line_segmentation', **_size_fields(image)) as sp:
+        boxes = _find_line_boxes(image, segmentation_params(preset))
+        sp.set(lines=len(boxes))
+    return boxes
 
-        contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=lambda c: cv2.boundingRect(c)[1])
+def _find_line_boxes(image, params):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = thresh.shape
 
-        print(f"[INFO] Found {len(contours)} line candidates")
+    if params['remove_rules']:
+        # notebook rulings and margins would put ink in every row, take them out first
+        rules = cv2.add(
+            cv2.morphologyEx(thresh, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 4, 1), 1))),
+            cv2.morphologyEx(thresh, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 4, 1)))))
+        thresh = cv2.subtract(thresh, rules)
 
-        lines = []
+    # horizontal projection profile: ink pixels per row, lightly smoothed
+    profile = np.count_nonzero(thresh, axis=1).astype(np.float32)
+    window = params['smooth_rows']
+    if window > 1:
+        profile = np.convolve(profile, np.ones(window, np.float32) / window, mode='same')
+    text_rows = profile > params['min_ink'] * width
 
-        for i, cnt in enumerate(contours):
-            x, y, w, h = cv2.boundingRect(cnt)
-            if h < 15 or w < 50:
-                continue
+    # runs of text rows -> [start, end) bands, closing small gaps inside a line
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], text_rows.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if starts.size > 1:
+        keep = starts[1:] - ends[:-1] > params['min_gap']
+        starts = np.concatenate((starts[:1], starts[1:][keep]))
+        ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+
+    tall = ends - starts >= params['min_height']
+    starts, ends = starts[tall], ends[tall]
+    if starts.size == 0:
+        return []
 
-            print(f"[INFO] Processing line {i+1}: x={x}, y={y}, w={w}, h={h}")
+    # which columns have ink in each band, all bands in one reduceat over the rows
+    ink = np.vstack((thresh > 0, np.zeros((1, width), bool)))
+    bounds = np.column_stack((starts, ends)).ravel()
+    band_cols = np.logical_or.reduceat(ink, bounds, axis=0)[0::2]
+    has_ink = band_cols.any(axis=1)
+    lefts = np.argmax(band_cols, axis=1)
+    rights = width - np.argmax(band_cols[:, ::-1], axis=1)
 
-            line_img = image[y:y+h, x:x+w]
-            pil_img = Image.fromarray(cv2.cvtColor(line_img, cv2.COLOR_BGR2RGB)).resize((384, 384))
+    pad = params['pad']
+    boxes = []
+    for i in np.flatnonzero(has_ink & (rights - lefts >= params['min_width'])):
+        x0, y0 = max(int(lefts[i]) - pad, 0), max(int(starts[i]) - pad, 0)
+        x1, y1 = min(int(rights[i]) + pad, width), min(int(ends[i]) + pad, height)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
 
-            pixel_values = processor(images=pil_img, return_tensors="pt").pixel_values
-            generated_ids = model.generate(pixel_values)
-            text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-            lines.append(text.strip())
+def handwritten_line_crops(image, preset='default'):
+    # one colour conversion for the page, the crops are views into it
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return [rgb[y:y+h, x:x+w] for x, y, w, h in segment_handwritten_lines(image, preset)]
 
-        if not lines:
-            print("[WARN] No valid lines found.")
-            return "No handwriting detected."
+def _join_lines(lines):
+    if not lines:
+        print("[WARN] No valid lines found.")
+        return "No handwriting detected."
+    return "\n".join(lines)
 
-        return "\n".join(lines)
+def extract_handwritten_text_by_line(image_path, preset='default'):
+    try:
+        image = load_image(image_path)
+        if image is None:
+            print("[ERROR] Failed to load image.")
+            return ""
+
+        # all lines of the page go through the model together
+        crops = handwritten_line_crops(image, preset)
+        with span('trocr', lines=len(crops)):
+            lines = get_trocr_engine().recognize(crops)
+        return _join_lines(lines)
 
     except Exception as e:
         print(f"[ERROR] Exception in extract_handwritten_text_by_line: {e}")
         return "Error during handwriting OCR."
 
-def process_and_extract(image_path):
+def iter_handwritten_lines(image_path, batch_size=None, preset='default'):
+    """
+    Recognise a handwritten page a batch of lines at a time, so callers can show
+    partial results. Yields (lines_done, lines_total, texts).
+    """
+    image = load_image(image_path)
+    if image is None:
+        raise ValueError("Could not load the image.")
+    crops = handwritten_line_crops(image, preset)
+    engine = get_trocr_engine()
+    step = batch_size or engine.batch_size
+    for start in range(0, len(crops), step):
+        with span('trocr', lines=len(crops[start:start + step])):
+            texts = engine.recognize(crops[start:start + step])
+        yield start + len(texts), len(crops), texts
+
+def extract_handwritten_text_batch(image_paths, preset='default'):
+    """
+    Handwriting OCR for several pages at once: the line crops of every page are
+    batched together through TrOCR. Returns one text per path.
+    """
+    texts = [""] * len(image_paths)
+    pages, page_ids = [], []
+    for i, image_path in enumerate(image_paths):
+        image = load_image(image_path)
+        if image is None:
+            print(f"[ERROR] Failed to load image: {image_path}")
+            continue
+        pages.append(handwritten_line_crops(image, preset))
+        page_ids.append(i)
+
+    try:
+        with span('trocr', pages=len(pages), lines=sum(len(crops) for crops in pages)):
+            page_lines = get_trocr_engine().recognize_pages(pages)
+        for i, lines in zip(page_ids, page_lines):
+            texts[i] = _join_lines(lines)
+    except Exception as e:
+        print(f"[ERROR] Exception in extract_handwritten_text_batch: {e}")
+        for i in page_ids:
+            texts[i] = "Error during handwriting OCR."
+    return texts
+
+def _content_cache_key(content_hash, adaptive=False):
+    # whole-input key: lets a repeat run skip preprocessing as well as Tesseract
+    if adaptive:
+        return make_key('file', content_hash, PREPROCESS_PARAMS, ADAPTIVE_PARAMS, TESSERACT_CONFIG, tesseract_version())
+    return make_key('file', content_hash, PREPROCESS_PARAMS, TESSERACT_CONFIG, tesseract_version())
+
+def file_cache_key(image_path, adaptive=False):
+    """Printed-text cache key for an image file, or None when caching is off or the file is missing."""
+    if get_cache() is None or not os.path.exists(image_path):
+        return None
+    return _content_cache_key(hash_file(image_path), adaptive)
+
+def process_and_extract(image_path, images=True):
+    """
+    Printed text OCR for a path, encoded image bytes or a BGR array.
+    Returns (gray, processed, original, text), all in memory; OCR errors are
+    raised. The cache is checked before preprocessing; with images=False a
+    hit skips it entirely and gray / processed come back as None.
+    """
     # ye function sirf printed text ke liye tha, ab bhi waisa hi kaam karega
-    gray, processed, original = preprocess_image(image_path)
-    if processed is not None:       # image type agar wrong hoga yaha check
-        text = extract_text(processed)
-        return gray, processed, original, text
-    return None, None, None, None
+    original, content_hash = read_source(image_path)
+    if original is None:       # image type agar wrong hoga yaha check
+        print("Could not load the image. Check the path!")
+        return None, None, None, None
+
+    cache = get_cache()
+    key = _content_cache_key(content_hash, ADAPTIVE_PREPROCESS) if cache else None
+    text = cache.get(key) if key else None
+    gray = processed = None
+    if text is None or images:
+        if ADAPTIVE_PREPROCESS:
+            gray, processed, _, _ = preprocess_adaptive(original)
+        else:
+            gray, processed, _ = preprocess_image(original)
+    if text is None:
+        # stored under the whole-input key only, not a second time under the processed array's hash;
+        # an OCR failure raises here, so an empty text from a missing tesseract is never cached
+        text = extract_text(processed, use_cache=False, raise_errors=True)
+        if key:
+            cache.put(key, text)
+    return gray, processed, original, text
+
+# cascade: tesseract lines with a mean word confidence below this go to TrOCR
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('OCR_CASCADE_MIN_CONF', '60'))
+CASCADE_ESCALATION_ENGINE = 'trocr'
+CASCADE_CONFIG = TESSERACT_CONFIG
+
+# per-engine call counts and time, and how often the cascade escalated
+_engine_stats = {}
+_engine_stats_lock = threading.Lock()
+
+def _record_engine(name, seconds, lines):
+    with _engine_stats_lock:
+        stats = _engine_stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'lines': 0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['lines'] += lines
+
+def _record_cascade(lines, escalated):
+    with _engine_stats_lock:
+        stats = _engine_stats.setdefault('cascade', {'pages': 0, 'lines': 0, 'escalated': 0})
+        stats['pages'] += 1
+        stats['lines'] += lines
+        stats['escalated'] += escalated
+
+def engine_stats():
+    """
+    Snapshot of the engine counters: {engine: {calls, seconds, lines, mean_ms}}
+    plus 'cascade': {pages, lines, escalated, escalation_rate}.
+    """
+    with _engine_stats_lock:
+        result = {name: dict(stats) for name, stats in _engine_stats.items()}
+    for name, stats in result.items():
+        if name == 'cascade':
+            stats['escalation_rate'] = stats['escalated'] / stats['lines'] if stats['lines'] else 0.0
+        else:
+            stats['mean_ms'] = stats['seconds'] / stats['calls'] * 1000 if stats['calls'] else 0.0
+    return result
+
+def cascade_first_pass(image_path, min_confidence=CASCADE_MIN_CONFIDENCE):
+    """
+    Cheap half of the cascade: tesseract word boxes on the preprocessed page,
+    grouped into lines. Returns (original, lines, escalate, crops): lines is a
+    list of {'text', 'conf', 'box'}, escalate the indices of the lines below
+    min_confidence and crops their RGB crops from the original image.
+    """
+    _, processed, original = preprocess_image(image_path)
+    if processed is None:
+        return None, [], [], []
+
+    start = time.perf_counter()
+    with span('cascade_tesseract') as sp:
+        words = get_ocr_engine().image_to_data(processed, config=CASCADE_CONFIG)
+        grouped = {}
+        for word in words:
+            grouped.setdefault(word['line'], []).append(word)
+        lines = []
+        for line_words in grouped.values():
+            line_words.sort(key=lambda w: w['left'])
+            x0 = min(w['left'] for w in line_words)
+            y0 = min(w['top'] for w in line_words)
+            x1 = max(w['left'] + w['width'] for w in line_words)
+            y1 = max(w['top'] + w['height'] for w in line_words)
+            lines.append({'text': " ".join(w['text'] for w in line_words),
+                          'conf': sum(w['conf'] for w in line_words) / len(line_words),
+                          'box': (x0, y0, x1 - x0, y1 - y0)})
+        sp.set(lines=len(lines))
+    _record_engine('tesseract', time.perf_counter() - start, len(lines))
+
+    escalate = [i for i, line in enumerate(lines)
+                if line['conf'] < min_confidence and line['box'][2] >= 8 and line['box'][3] >= 8]
+    crops = []
+    if escalate:
+        rgb = cv2.cvtColor(original, cv2.COLOR_BGR2RGB)
+        height, width = rgb.shape[:2]
+        for i in escalate:
+            x, y, w, h = lines[i]['box']
+            crops.append(rgb[max(y - 4, 0):min(y + h + 4, height), max(x - 4, 0):min(x + w + 4, width)])
+    return original, lines, escalate, crops
+
+def merge_cascade(lines, escalate, texts):
+    """Put the escalated lines' texts in place and join the page text."""
+    _record_cascade(len(lines), len(escalate))
+    merged = [line['text'] for line in lines]
+    for i, text in zip(escalate, texts):
+        if text:
+            merged[i] = text
+    return "\n".join(merged)
+
+def extract_text_cascade(image_path, min_confidence=CASCADE_MIN_CONFIDENCE):
+    """
+    Printed text first, neural model only where needed: tesseract reads the
+    page, and only the lines it is unsure about (mean word confidence below
+    min_confidence) are re-read by TrOCR, all in one batch.
+    Returns (original, text).
+    """
+    original, lines, escalate, crops = cascade_first_pass(image_path, min_confidence)
+    if original is None:
+        return None, ""
+    texts = []
+    if crops:
+        start = time.perf_counter()
+        with span('cascade_trocr', lines=len(crops)):
+            try:
+                texts = get_engine(CASCADE_ESCALATION_ENGINE).recognize(crops)
+            except Exception as e:
+                # without the neural model the cascade degrades to plain tesseract
+                print(f"[ERROR] Escalation to {CASCADE_ESCALATION_ENGINE} failed: {e}")
+            else:
+                _record_engine(CASCADE_ESCALATION_ENGINE, time.perf_counter() - start, len(crops))
+    return original, merge_cascade(lines, escalate, texts)
 
 def handle_user_choice(image_path, choice):
     """
-    choice: 'printed' or 'handwritten'
+    image_path: file path, encoded image bytes or a BGR numpy array
+    choice: 'printed', 'handwritten' or 'auto' (tesseract, low confidence lines re-read by TrOCR)
     """
     if choice == 'printed':
         # printed text ke liye existing flow
         gray, processed, original, text = process_and_extract(image_path)
         return {'gray': gray, 'processed': processed, 'original': original, 'text': text}
     elif choice == 'handwritten':
-        text = extract_handwritten_text_by_line(image_path)
-        return {'gray': None, 'processed': None, 'original': cv2.imread(image_path), 'text': text}
+        # decode once and hand the same array to the line recogniser
+        original = load_image(image_path)
+        text = extract_handwritten_text_by_line(original) if original is not None else ""
+        return {'gray': None, 'processed': None, 'original': original, 'text': text}
+    elif choice == 'auto':
+        original, text = extract_text_cascade(image_path)
+        return {'gray': None, 'processed': None, 'original': original, 'text': text}
 
     else:
-        raise ValueError("Invalid choice. Must be 'printed' or 'handwritten'.")
+        raise ValueError("Invalid choice. Must be 'printed', 'handwritten' or 'auto'.")
@@ -0,0 +1,304 @@
+"""
+Benchmark the stages of the OCR pipeline on the bundled sample images.
+
+    python benchmark.py                          # run and print the table
+    python benchmark.py --save bench.json        # also store the results as a baseline
+    python benchmark.py --compare bench.json     # flag stages slower than the baseline
+    python benchmark.py --imports                # check import time of the entry points
+
+Reports p50/p95 latency, throughput and peak RSS for every stage. Results go
+through the OCR engines directly, the OCR cache is switched off.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+# cached OCR results would make every tesseract stage look free
+os.environ['OCR_CACHE'] = '0'
+
+import cv2
+import numpy as np
+
+import backend
+import table_extractor
+
+img_dir = 'dataset/img'
+PRINTED_SAMPLES = ['pic1.png', 'pic2.jpeg']
+HANDWRITTEN_SAMPLES = ['hw1.png', 'hw2.png']
+TABLE_SAMPLES = ['pic1.png']
+# stages that need a working Tesseract, skipped as failed without one
+TESSERACT_STAGES = ('extract_text', 'table_per_cell', 'table_single_pass')
+
+# modules that may only be imported when a feature actually needs them
+HEAVY_MODULES = ('torch', 'transformers', 'pytesseract', 'tesserocr', 'pandas', 'matplotlib',
+                 'seaborn', 'sklearn', 'reportlab')
+IMPORT_CHECK_MODULES = ['backend', 'table_extractor', 'documents', 'service', 'test_model',
+                        'results_store', 'error_report', 'frontend']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (tesseract), in MB."""
+    try:
+        import resource
+    except ImportError:
+        # windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20, 0.0
+        except (ImportError, AttributeError):
+            return 0.0, 0.0
+    # ru_maxrss is in KB on linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+    return self_rss, child_rss
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def run(self, stage, fn, *args):
+        """Time fn(*args) under stage. Returns its result, or None if the stage failed."""
+        if stage in self.errors:
+            return None
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            # a missing dependency (tesseract, transformers, ...) disables that stage only
+            self.errors[stage] = f"{type(e).__name__}: {e}"
+            return None
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        stages = {}
+        for stage, durations in self.samples.items():
+            durations = np.array(durations)
+            stages[stage] = {
+                'count': int(durations.size),
+                'p50_ms': float(np.percentile(durations, 50) * 1000),
+                'p95_ms': float(np.percentile(durations, 95) * 1000),
+                'mean_ms': float(durations.mean() * 1000),
+                'images_per_sec': float(durations.size / durations.sum()) if durations.sum() > 0 else 0.0,
+            }
+        return stages
+
+
+def bench_preprocess(timer, path):
+    image = timer.run('decode', cv2.imread, path)
+    if image is None:
+        return
+    params = backend.PREPROCESS_PARAMS
+    gray = timer.run('grayscale', cv2.cvtColor, image, cv2.COLOR_BGR2GRAY)
+    clahe = cv2.createCLAHE(clipLimit=params['clahe_clip_limit'], tileGridSize=params['clahe_tile_grid'])
+    gray = timer.run('clahe', clahe.apply, gray)
+    _, binary = timer.run('otsu', cv2.threshold, gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = np.ones(params['open_kernel'], np.uint8)
+    timer.run('morph_open', cv2.morphologyEx, binary, cv2.MORPH_OPEN, kernel)
+
+    _, processed, _ = timer.run('preprocess_image', backend.preprocess_image, path) or (None, None, None)
+    if processed is not None and _tesseract_available(timer):
+        # raise_errors: a failing call marks the stage failed instead of timing the error path
+        timer.run('extract_text', lambda: backend.extract_text(processed, raise_errors=True))
+
+
+def _tesseract_available(timer):
+    # extract_text turns OCR errors into "", and a table without cells never calls the engine,
+    # so ask the engine for its version first and mark the Tesseract stages failed without it
+    try:
+        backend.get_ocr_engine().version()
+    except Exception as e:
+        for stage in TESSERACT_STAGES:
+            timer.errors.setdefault(stage, f"{type(e).__name__}: {e}")
+        return False
+    return True
+
+
+def _trocr_available(timer):
+    # extract_handwritten_text_by_line swallows a missing model and returns an error text,
+    # so load it up front and mark the TrOCR stages failed instead of timing that fast path
+    try:
+        backend.get_trocr_engine()
+    except Exception as e:
+        for stage in ('hw_trocr', 'extract_handwritten_text_by_line'):
+            timer.errors.setdefault(stage, f"{type(e).__name__}: {e}")
+        return False
+    return True
+
+
+def bench_handwriting(timer, path):
+    image = cv2.imread(path)
+    if image is None:
+        return
+    crops = timer.run('hw_segment_lines', backend.handwritten_line_crops, image)
+    if not _trocr_available(timer):
+        return
+    if crops:
+        timer.run('hw_trocr', lambda: backend.get_trocr_engine().recognize(crops))
+    timer.run('extract_handwritten_text_by_line', backend.extract_handwritten_text_by_line, path)
+
+
+def bench_tables(timer, path):
+    if not _tesseract_available(timer):
+        return
+    timer.run('table_per_cell', table_extractor.extract_tables_from_image, path)
+    timer.run('table_single_pass', table_extractor.extract_table_grid, path)
+
+
+def run_benchmark(limit, repeat, stages):
+    dataset = sorted(f for f in os.listdir(img_dir) if f.endswith(('.jpg', '.png', '.jpeg')))[:limit]
+    printed = PRINTED_SAMPLES + [os.path.join(img_dir, f) for f in dataset]
+
+    timer = StageTimer()
+    # first pass loads tesseract / TrOCR; keep it out of the numbers
+    if 'printed' in stages:
+        bench_preprocess(StageTimer(), printed[0])
+
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        if 'printed' in stages:
+            for path in printed:
+                bench_preprocess(timer, path)
+        if 'handwritten' in stages:
+            for path in HANDWRITTEN_SAMPLES:
+                bench_handwriting(timer, path)
+        if 'table' in stages:
+            for path in TABLE_SAMPLES:
+                bench_tables(timer, path)
+    wall = time.perf_counter() - wall_start
+
+    self_rss, child_rss = peak_rss_mb()
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ocr_engine': backend.tesseract_version(),
+            'repeat': repeat,
+            'dataset_images': len(dataset),
+            'wall_seconds': wall,
+            'peak_rss_mb': self_rss,
+            'peak_child_rss_mb': child_rss,
+        },
+        'stages': timer.summary(),
+        'errors': timer.errors,
+    }
+
+
+def import_time_ms(module, runs=3):
+    """
+    Cumulative import time of module in a fresh interpreter (best of runs, ms)
+    and the heavy modules it pulled in, from python -X importtime.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    best, heavy = None, set()
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              cwd=here, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            if name.split('.')[0] in HEAVY_MODULES:
+                heavy.add(name.split('.')[0])
+            if name == module and cumulative.strip().isdigit():
+                ms = int(cumulative) / 1000
+                best = ms if best is None else min(best, ms)
+    return best, sorted(heavy)
+
+
+def check_imports(budget_ms, modules=IMPORT_CHECK_MODULES):
+    """Print import times; returns the modules over budget or importing a heavy dependency."""
+    failures = []
+    print(f"{'module':20} {'import ms':>10}  heavy imports")
+    for module in modules:
+        try:
+            ms, heavy = import_time_ms(module)
+        except RuntimeError as e:
+            # a missing optional dependency (tkinter, ...) is not a startup regression
+            print(f"{module:20} {'-':>10}  [SKIPPED] {e}")
+            continue
+        flag = ''
+        if heavy or ms > budget_ms:
+            flag = '  OVER BUDGET' if ms > budget_ms else '  EAGER IMPORT'
+            failures.append(module)
+        print(f"{module:20} {ms:>10.1f}  {', '.join(heavy) or '-'}{flag}")
+    return failures
+
+
+def print_results(results):
+    print(f"{'stage':34} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'img/s':>10}")
+    for stage, s in results['stages'].items():
+        print(f"{stage:34} {s['count']:>5} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['images_per_sec']:>10.1f}")
+    meta = results['meta']
+    print(f"\nPeak RSS: {meta['peak_rss_mb']:.1f} MB (children: {meta['peak_child_rss_mb']:.1f} MB), "
+          f"wall time {meta['wall_seconds']:.1f}s")
+    for stage, error in results['errors'].items():
+        print(f"[SKIPPED] {stage}: {error}")
+
+
+def compare(results, baseline, tolerance):
+    """Print p50 changes against a baseline. Returns the list of regressed stages."""
+    regressions = []
+    print(f"\n{'stage':34} {'base p50':>10} {'now p50':>10} {'change':>8}")
+    for stage, s in results['stages'].items():
+        old = baseline['stages'].get(stage)
+        if old is None or old['p50_ms'] <= 0:
+            continue
+        change = s['p50_ms'] / old['p50_ms'] - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(stage)
+        print(f"{stage:34} {old['p50_ms']:>10.2f} {s['p50_ms']:>10.2f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR pipeline stages")
+    parser.add_argument('--limit', type=int, default=50, help="number of dataset/img images to use")
+    parser.add_argument('--repeat', type=int, default=1, help="passes over the sample set")
+    parser.add_argument('--stages', nargs='+', default=['printed', 'handwritten', 'table'],
+                        choices=['printed', 'handwritten', 'table'])
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed p50 slowdown before a stage is flagged (0.2 = 20%%)")
+    parser.add_argument('--imports', action='store_true',
+                        help="only check the import time of the entry points, exit 1 when over budget")
+    parser.add_argument('--import-budget-ms', type=float, default=1000.0,
+                        help="cold import budget per module for --imports")
+    args = parser.parse_args()
+
+    if args.imports:
+        if check_imports(args.import_budget_ms):
+            sys.exit(1)
+        return
+
+    results = run_benchmark(args.limit, args.repeat, args.stages)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
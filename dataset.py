@@ -0,0 +1,202 @@
+"""
+Index and loader for the evaluation dataset (dataset/img + dataset/text).
+
+    from dataset import Dataset
+
+    ds = Dataset()
+    entries = ds.select(skip_empty_gt=True, shard=(0, 4))
+    for entry, image in ds.iter_images(entries, prefetch=8):
+        ...
+
+The manifest (id, paths, ground truth text and length, empty-GT flag, image
+size) is built once and cached next to the data. On later runs only files
+whose size or mtime changed are read again.
+"""
+import os
+import json
+import zlib
+import queue
+import threading
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+MANIFEST_VERSION = 1
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _image_size(path):
+    # PIL only parses the header here, no full decode
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+        return width, height
+    except OSError:
+        return None, None
+
+
+class Dataset:
+    """
+    img_dir / gt_dir -- images and their <id>.txt ground truth files
+    manifest_path    -- cached index, defaults to <img_dir>/../manifest.json
+    """
+
+    def __init__(self, img_dir='dataset/img', gt_dir='dataset/text', manifest_path=None, rebuild=False):
+        self.img_dir = img_dir
+        self.gt_dir = gt_dir
+        self.manifest_path = manifest_path or os.path.join(os.path.dirname(os.path.normpath(img_dir)), 'manifest.json')
+        self.entries = self._load_manifest(rebuild)
+
+    def _build_entry(self, filename, old):
+        file_id = os.path.splitext(filename)[0]
+        image_path = os.path.join(self.img_dir, filename)
+        gt_path = os.path.join(self.gt_dir, f"{file_id}.txt")
+        image_sig, gt_sig = _signature(image_path), _signature(gt_path)
+        if old and old['image_sig'] == image_sig and old['gt_sig'] == gt_sig:
+            return old, False
+
+        ground_truth = None
+        if gt_sig is not None:
+            with open(gt_path, 'r', encoding='utf-8') as f:
+                ground_truth = f.read().strip()
+        width, height = _image_size(image_path)
+        return {
+            'id': file_id,
+            'filename': filename,
+            'image_path': image_path,
+            'gt_path': gt_path,
+            'has_gt': ground_truth is not None,
+            'ground_truth': ground_truth,
+            'gt_length': len(ground_truth) if ground_truth else 0,
+            'empty_gt': ground_truth == '',
+            'width': width,
+            'height': height,
+            'image_sig': image_sig,
+            'gt_sig': gt_sig,
+        }, True
+
+    def _load_manifest(self, rebuild):
+        cached = {}
+        if not rebuild and os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    cached = {entry['filename']: entry for entry in manifest['entries']}
+            except (OSError, ValueError, KeyError):
+                cached = {}
+
+        filenames = sorted(f for f in os.listdir(self.img_dir) if f.endswith(IMAGE_EXTENSIONS))
+        entries, dirty = [], len(cached) != len(filenames)
+        for filename in filenames:
+            entry, changed = self._build_entry(filename, cached.get(filename))
+            entries.append(entry)
+            dirty = dirty or changed
+
+        if dirty:
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+        return entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'images': len(self.entries),
+            'missing_gt': sum(not e['has_gt'] for e in self.entries),
+            'empty_gt': sum(e['empty_gt'] for e in self.entries),
+        }
+
+    def select(self, skip_missing_gt=False, skip_empty_gt=False, min_gt_length=0, ids=None,
+               shard=None, limit=None):
+        """
+        Filtered list of manifest entries. shard=(index, count) keeps the
+        entries whose id hashes to index, so every machine of a multi-machine
+        run can take its part without coordination, and adding images doesn't
+        move the existing ones to other shards.
+        """
+        ids = set(ids) if ids is not None else None
+        selected = []
+        for entry in self.entries:
+            if skip_missing_gt and not entry['has_gt']:
+                continue
+            if skip_empty_gt and entry['empty_gt']:
+                continue
+            if entry['gt_length'] < min_gt_length:
+                continue
+            if ids is not None and entry['id'] not in ids:
+                continue
+            if shard is not None and zlib.crc32(entry['id'].encode('utf-8')) % shard[1] != shard[0]:
+                continue
+            selected.append(entry)
+        return selected[:limit] if limit else selected
+
+    def iter_images(self, entries, prefetch=8):
+        """
+        Yield (entry, BGR image or None) for the entries, decoding the next
+        `prefetch` images on a background thread while the caller works on the
+        current one.
+        """
+        if prefetch <= 0:
+            for entry in entries:
+                yield entry, cv2.imread(entry['image_path'])
+            return
+
+        buffer = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # give up once the consumer has stopped, instead of blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def decode():
+            for entry in entries:
+                # imread releases the GIL, so this overlaps with the OCR in the main thread
+                if not put((entry, cv2.imread(entry['image_path']))):
+                    return
+            put(done)
+
+        worker = threading.Thread(target=decode, name='dataset-prefetch', daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    return
+                yield item
+        finally:
+            stop.set()
+            # free a slot in case the worker is mid-put, then wait for it so no imread outlives the loop
+            while True:
+                try:
+                    buffer.get_nowait()
+                except queue.Empty:
+                    break
+            worker.join()
+
+
+def parse_shard(value):
+    """'1/4' -> (1, 4), for --shard options."""
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"shard index must be in [0, {count}), got {index}")
+    return index, count
@@ -0,0 +1,231 @@
+"""
+Streaming OCR for multi-page and very large documents.
+
+    python documents.py scan.tiff
+    python documents.py report.pdf --dpi 200 --output report.txt
+
+Pages are read lazily (multi-page TIFF through PIL, PDF rasterised one page
+at a time with pypdfium2 or PyMuPDF), and results come out of a generator, so
+memory stays bounded by a single page and the first page's text is available
+before the rest of the document has been read. Pages above TILE_THRESHOLD_PIXELS
+are preprocessed and OCR'd in horizontal strips.
+"""
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+import backend
+from instrumentation import span
+
+# pages bigger than this (about an A4 page at 400 dpi) go through the strip path
+TILE_THRESHOLD_PIXELS = 16_000_000
+STRIP_HEIGHT = 1024
+STRIP_OVERLAP = 64
+OCR_STRIP_HEIGHT = 2048
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+
+def _pil_to_bgr(pil_image):
+    rgb = np.asarray(pil_image.convert('RGB'))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def _iter_tiff_pages(path):
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as tiff:
+        # ImageSequence seeks frame by frame, only the current page is decoded
+        for frame in ImageSequence.Iterator(tiff):
+            yield _pil_to_bgr(frame)
+
+
+def _iter_pdf_pages(path, dpi):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        pdfium = None
+
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for index in range(len(pdf)):
+                page = pdf[index]
+                bitmap = page.render(scale=dpi / 72)
+                image = _pil_to_bgr(bitmap.to_pil())
+                page.close()
+                yield image
+        finally:
+            pdf.close()
+        return
+
+    try:
+        import fitz
+    except ImportError:
+        raise ImportError("PDF input needs pypdfium2 or PyMuPDF (pip install pypdfium2)") from None
+
+    with fitz.open(path) as doc:
+        for page in doc:
+            pix = page.get_pixmap(dpi=dpi)
+            image = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+            code = cv2.COLOR_RGBA2BGR if pix.n == 4 else cv2.COLOR_RGB2BGR
+            yield cv2.cvtColor(image, code) if pix.n >= 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def iter_pages(path, dpi=300):
+    """Yield the pages of an image / multi-page TIFF / PDF as BGR arrays, one at a time."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TIFF_EXTENSIONS:
+        yield from _iter_tiff_pages(path)
+    elif ext == '.pdf':
+        yield from _iter_pdf_pages(path, dpi)
+    else:
+        image = backend.load_image(path)
+        if image is None:
+            raise ValueError(f"Could not load the image: {path}")
+        yield image
+
+
+def _otsu_from_histogram(hist):
+    # same criterion as cv2.THRESH_OTSU, but on a histogram gathered strip by strip
+    hist = hist.astype(np.float64)
+    levels = np.arange(hist.size)
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    sum0 = np.cumsum(hist * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean0 = sum0 / w0
+        mean1 = (sum0[-1] - sum0) / w1
+        between = w0 * w1 * (mean0 - mean1) ** 2
+    between[~np.isfinite(between)] = 0
+    return int(np.argmax(between))
+
+
+def preprocess_tiled(image, strip_height=STRIP_HEIGHT, overlap=STRIP_OVERLAP):
+    """
+    preprocess_image for very large pages: CLAHE runs on overlapping horizontal
+    strips (overlap cropped off when stitching) and Otsu uses one histogram
+    collected over all strips, so only the output page is held in full.
+    Returns the binary page.
+    """
+    params = backend.PREPROCESS_PARAMS
+    height, width = image.shape[:2]
+    grid_x, grid_y = params['clahe_tile_grid']
+    # keep CLAHE tiles the same size in pixels as on the whole page
+    tile_height = height / grid_y
+
+    page = np.empty((height, width), np.uint8)
+    hist = np.zeros(256, np.int64)
+    with span('tiled_clahe', height=height, width=width):
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            lo, hi = max(top - overlap, 0), min(bottom + overlap, height)
+            strip = cv2.cvtColor(image[lo:hi], cv2.COLOR_BGR2GRAY)
+            rows = max(1, int(round((hi - lo) / tile_height)))
+            clahe = cv2.createCLAHE(clipLimit=params['clahe_clip_limit'], tileGridSize=(grid_x, rows))
+            strip = clahe.apply(strip)
+            page[top:bottom] = strip[top - lo:top - lo + (bottom - top)]
+            hist += np.bincount(page[top:bottom].ravel(), minlength=256)
+
+    with span('tiled_otsu'):
+        threshold = _otsu_from_histogram(hist)
+        for top in range(0, height, strip_height):
+            rows = page[top:top + strip_height]
+            cv2.threshold(rows, threshold, 255, cv2.THRESH_BINARY, dst=rows)
+
+    if tuple(params['open_kernel']) != (1, 1):
+        kernel = np.ones(params['open_kernel'], np.uint8)
+        page = cv2.morphologyEx(page, cv2.MORPH_OPEN, kernel)
+    return page
+
+
+def split_text_strips(binary, max_height=OCR_STRIP_HEIGHT):
+    """
+    (top, bottom) row ranges of at most max_height rows. Each cut goes on the
+    row with the least ink in the last quarter of the window, so specks and
+    scan noise don't stop it from landing in the gap between two text lines.
+    """
+    height = binary.shape[0]
+    ink = np.count_nonzero(binary == 0, axis=1)
+    strips = []
+    top = 0
+    while top < height:
+        bottom = min(top + max_height, height)
+        if bottom < height:
+            start = top + max_height * 3 // 4
+            window = ink[start:bottom]
+            # the last of the emptiest rows, keeps strips as tall as allowed
+            bottom = start + len(window) - 1 - int(np.argmin(window[::-1])) + 1
+        strips.append((top, bottom))
+        top = bottom
+    return strips
+
+
+def ocr_page(page, mode='printed', tile_threshold=TILE_THRESHOLD_PIXELS):
+    """OCR one page array. Returns (text, tiled)."""
+    if mode == 'handwritten':
+        return backend.extract_handwritten_text_by_line(page), False
+
+    height, width = page.shape[:2]
+    if height * width <= tile_threshold:
+        _, processed, _ = backend.preprocess_image(page)
+        return backend.extract_text(processed), False
+
+    binary = preprocess_tiled(page)
+    texts = []
+    for top, bottom in split_text_strips(binary):
+        text = backend.extract_text(binary[top:bottom])
+        if text:
+            texts.append(text)
+    return "\n".join(texts), True
+
+
+def iter_document(path, mode='printed', dpi=300, tile_threshold=TILE_THRESHOLD_PIXELS):
+    """
+    OCR a document page by page. Yields one dict per page as soon as it is done:
+    {'page', 'text', 'height', 'width', 'tiled', 'seconds'}.
+    """
+    for number, page in enumerate(iter_pages(path, dpi), start=1):
+        start = time.perf_counter()
+        height, width = page.shape[:2]
+        with span('document_page', page=number, height=height, width=width):
+            text, tiled = ocr_page(page, mode, tile_threshold)
+        del page
+        yield {
+            'page': number,
+            'text': text,
+            'height': height,
+            'width': width,
+            'tiled': tiled,
+            'seconds': time.perf_counter() - start,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR a multi-page TIFF / PDF or a very large image page by page")
+    parser.add_argument('path')
+    parser.add_argument('--mode', choices=['printed', 'handwritten'], default='printed')
+    parser.add_argument('--dpi', type=int, default=300, help="rasterisation DPI for PDF pages")
+    parser.add_argument('--output', help="append page texts to this file as they finish")
+    args = parser.parse_args()
+
+    out = open(args.output, 'a', encoding='utf-8') if args.output else None
+    try:
+        for result in iter_document(args.path, args.mode, args.dpi):
+            header = (f"--- page {result['page']} ({result['width']}x{result['height']}"
+                      f"{', tiled' if result['tiled'] else ''}, {result['seconds']:.1f}s) ---")
+            print(header)
+            print(result['text'])
+            if out:
+                out.write(header + "\n" + result['text'] + "\n")
+                out.flush()
+    finally:
+        if out:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Static error-analysis report for an evaluation run.
+
+    from error_report import write_html_report, write_confusion_png
+
+    write_html_report(stats, 'eval_report.html')     # stats: metrics.MetricsAccumulator
+    write_confusion_png(stats, 'confusion_matrix.png')
+
+Everything comes from the accumulator's sparse confusion counts: top-k
+confusion pairs, per-character precision / recall / F1 and a confusion grid
+of the most error-prone characters. The HTML needs no plotting library, the
+PNG uses matplotlib's Agg backend, so neither needs a display.
+"""
+import html
+import unicodedata
+
+import numpy as np
+
+# characters shown in the confusion grid / PNG, picked by number of errors
+GRID_CHARS = 30
+
+
+def char_label(char):
+    """Printable name for a character: GAP, whitespace and control chars spelled out."""
+    if char == '':
+        return '∅'
+    if char.isspace() or unicodedata.category(char).startswith('C'):
+        return f"U+{ord(char):04X}"
+    return char
+
+
+def error_chars(stats, limit=GRID_CHARS):
+    """The ground truth characters with the most errors (support - correct)."""
+    scores = stats.per_char_scores()
+    errors = scores['support'] - scores['correct']
+    order = np.argsort(-errors, kind='stable')
+    return [scores['chars'][i] for i in order[:limit] if scores['support'][i] > 0]
+
+
+def summary_rows(stats):
+    total = stats.images
+    scores = stats.per_char_scores()
+    seen = scores['support'] > 0
+    return [
+        ('Images', f"{total}"),
+        ('Word-level accuracy', f"{stats.correct_words / total * 100:.2f}%" if total else '-'),
+        ('Character accuracy', f"{stats.correct_chars / stats.total_chars * 100:.2f}%" if stats.total_chars else '-'),
+        ('CER', f"{stats.edit_distance / stats.total_chars * 100:.2f}%" if stats.total_chars else '-'),
+        ('WER', f"{stats.word_errors / stats.total_words * 100:.2f}%" if stats.total_words else '-'),
+        ('Micro P / R / F1', f"{stats.micro_precision:.4f}"),
+        ('Macro F1 (ground truth chars)', f"{scores['f1'][seen].mean():.4f}" if seen.any() else '-'),
+        ('Distinct characters', f"{len(scores['chars'])}"),
+    ]
+
+
+def _table(headers, rows):
+    head = "".join(f"<th>{html.escape(h)}</th>" for h in headers)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(c))}</td>" for c in row) + "</tr>" for row in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+
+def _grid(stats, chars):
+    labels, matrix = stats.confusion_matrix(chars)
+    peak = matrix.max() if matrix.size else 0
+    cells = ["<tr><th>true \\ pred</th>" + "".join(f"<th>{html.escape(char_label(c))}</th>" for c in labels) + "</tr>"]
+    for label, row in zip(labels, matrix):
+        tds = []
+        for count in row:
+            # shade by count, darkest cell = peak
+            alpha = count / peak if peak else 0
+            tds.append(f'<td style="background: rgba(31, 119, 180, {alpha:.2f})">{count or ""}</td>')
+        cells.append(f"<tr><th>{html.escape(char_label(label))}</th>{''.join(tds)}</tr>")
+    return f"<table class=\"grid\">{''.join(cells)}</table>"
+
+
+def write_html_report(stats, path, top_k=50, title="OCR evaluation report"):
+    """Self-contained HTML: summary, top-k confusions, per-character scores and a confusion grid."""
+    scores = stats.per_char_scores()
+    per_char_rows = [
+        (char_label(c), s, p, k, f"{pr:.3f}", f"{rc:.3f}", f"{f:.3f}")
+        for c, s, p, k, pr, rc, f in zip(scores['chars'], scores['support'], scores['predicted'],
+                                          scores['correct'], scores['precision'], scores['recall'], scores['f1'])
+    ]
+    confusion_rows = [(char_label(t), char_label(p), n) for t, p, n in stats.top_confusions(top_k)]
+
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">",
+        f"<title>{html.escape(title)}</title>",
+        "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:2em}"
+        "td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}"
+        ".grid td{min-width:1.5em;font-size:80%}</style></head><body>",
+        f"<h1>{html.escape(title)}</h1>",
+        _table(('Metric', 'Value'), summary_rows(stats)),
+        f"<h2>Top {top_k} confusions</h2><p>∅ is a missing (deleted) or extra (inserted) character.</p>",
+        _table(('True', 'Predicted', 'Count'), confusion_rows),
+        f"<h2>Confusions among the {GRID_CHARS} most error-prone characters</h2>",
+        _grid(stats, error_chars(stats)),
+        "<h2>Per-character scores</h2>",
+        _table(('Char', 'Support', 'Predicted', 'Correct', 'Precision', 'Recall', 'F1'), per_char_rows),
+        "</body></html>",
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(parts))
+
+
+def write_confusion_png(stats, path=None, limit=GRID_CHARS):
+    """
+    Confusion matrix heatmap of the most error-prone characters. Saved to path
+    with the Agg backend; with path=None it opens a window instead.
+    """
+    import matplotlib
+    if path:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    labels, matrix = stats.confusion_matrix(error_chars(stats, limit))
+    labels = [char_label(c) for c in labels]
+    fig, ax = plt.subplots(figsize=(12, 8))
+    image = ax.imshow(matrix, cmap='Blues')
+    fig.colorbar(image, ax=ax, label='Number of Errors')
+    ax.set_xticks(range(len(labels)), labels, rotation=45)
+    ax.set_yticks(range(len(labels)), labels)
+    if len(labels) <= GRID_CHARS:
+        for (row, col), count in np.ndenumerate(matrix):
+            if count:
+                ax.text(col, row, str(count), ha='center', va='center', fontsize=7,
+                        color='white' if count > matrix.max() / 2 else 'black')
+    ax.set_title('Character Confusion Matrix', fontweight='bold')
+    ax.set_xlabel('Predicted Characters')
+    ax.set_ylabel('True Characters')
+    fig.tight_layout()
+    if path:
+        fig.savefig(path, dpi=150)
+        plt.close(fig)
+    else:
+        plt.show()
@@ -1,15 +1,22 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext
+from tkinter import filedialog, messagebox, scrolledtext, ttk
+import queue
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageTk
 import cv2
 import backend
-from table_extractor import extract_tables_from_image, cells_to_csv
+from table_extractor import extract_tables_from_image, extract_table_grid, detect_table_grid, cells_to_rows, rows_to_csv
 import os
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import simpleSplit
+
+class JobCancelled(Exception):
+    pass
+
 
 class OCRApp:
+    # finished OCR results kept per (mode, image, mtime) so repeated clicks are instant
+    RESULT_CACHE_SIZE = 16
+
     def __init__(self, root):
         self.root = root
         self.root.title("OCR Document Scanner")
@@ -18,9 +25,17 @@ class OCRApp:
         self.root.configure(bg="white")
 
         self.image_path = None
+        self.original_image = None  # decoded once on upload, reused by every OCR mode
         self.processed_image = None
         self.gray_image = None
 
+        # background OCR job state, only touched from the Tk thread
+        self.job_key = None
+        self.job_messages = None
+        self.cancel_event = None
+        self.job_interruptible = True
+        self.results = OrderedDict()
+
         # Sidebar Frame
         sidebar_frame = tk.Frame(root, bg="white", width=200, height=750)
         sidebar_frame.pack(side=tk.LEFT, fill=tk.Y)
@@ -37,6 +52,21 @@ class OCRApp:
         self.extract_table_btn = tk.Button(sidebar_frame, text="🧾 Extract Table", command=self.extract_table, state=tk.DISABLED)
         self.extract_table_btn.pack(pady=5, fill=tk.X)
 
+        # single pass: one page OCR placed into the ruled grid, faster but needs full rulings and can't be cancelled
+        self.table_grid_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(sidebar_frame, text="Single pass (ruled tables)", variable=self.table_grid_mode,
+                       bg="white", anchor=tk.W).pack(fill=tk.X)
+
+        # Progress of the running OCR job
+        self.progress = ttk.Progressbar(sidebar_frame, mode='determinate', maximum=100)
+        self.progress.pack(pady=(20, 5), fill=tk.X)
+
+        self.status_label = tk.Label(sidebar_frame, text="", bg="white", fg="gray", wraplength=180, justify=tk.LEFT)
+        self.status_label.pack(pady=5, fill=tk.X)
+
+        self.cancel_btn = tk.Button(sidebar_frame, text="✖ Cancel", command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_btn.pack(pady=5, fill=tk.X)
+
         # Main Frame for image and text display
         main_frame = tk.Frame(root, bg="white")
         main_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -83,19 +113,166 @@ class OCRApp:
         if not file_path:
             return
         
+        image = backend.load_image(file_path)
+        if image is None:
+            messagebox.showerror("Error", "Could not load the image.")
+            return
+
         self.image_path = file_path
-        self.display_image(file_path, self.orig_img_display)
+        self.original_image = image
+        self.display_image(image, self.orig_img_display)
 
         self.process_btn.config(state=tk.NORMAL)
         self.handwriting_btn.config(state=tk.NORMAL)
         self.extract_table_btn.config(state=tk.NORMAL)
 
+    # ---------- background jobs ----------
+
+    def _job_key(self, mode):
+        # mtime None: the file is gone or unreadable, the result can't be matched to it later
+        try:
+            mtime = os.path.getmtime(self.image_path)
+        except OSError:
+            mtime = None
+        return (mode, self.image_path, mtime)
+
+    def start_job(self, mode, work, on_done, on_message=None, interruptible=True):
+        """
+        Run work(post, cancelled) on a worker thread. post(kind, payload) sends
+        messages back to the Tk thread (handled by on_message); on_done(result)
+        runs on the Tk thread when the job finishes. interruptible=False means
+        work only checks cancelled() after a call that can't be stopped.
+        """
+        key = self._job_key(mode)
+        if key[2] is not None and key in self.results:
+            # same image, same mode, file unchanged -> reuse the earlier result
+            self.results.move_to_end(key)
+            on_done(self.results[key])
+            self.status_label.config(text="Done (cached)")
+            return
+        if self.job_key is not None:
+            # a job is already running, don't queue duplicates
+            return
+
+        self.job_key = key
+        self.job_interruptible = interruptible
+        self.job_messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self._set_busy(True)
+
+        messages, cancel_event = self.job_messages, self.cancel_event
+
+        def post(kind, payload=None):
+            messages.put((kind, payload))
+
+        def run():
+            try:
+                result = work(post, cancel_event.is_set)
+                post('done', result)
+            except JobCancelled:
+                post('cancelled')
+            except Exception as e:
+                post('error', e)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.root.after(50, self._poll_job, key, on_done, on_message)
+
+    def _poll_job(self, key, on_done, on_message):
+        if self.job_key != key:
+            return
+        try:
+            while True:
+                kind, payload = self.job_messages.get_nowait()
+                if kind == 'progress':
+                    done, total = payload
+                    self.progress.stop()
+                    self.progress.config(mode='determinate', value=100 * done / total if total else 0)
+                    self.status_label.config(text=f"{done} / {total}")
+                elif kind == 'status':
+                    self.status_label.config(text=payload)
+                elif kind == 'done':
+                    self._finish_job()
+                    if key[2] is not None:
+                        self.results[key] = payload
+                        if len(self.results) > self.RESULT_CACHE_SIZE:
+                            self.results.popitem(last=False)
+                    self.status_label.config(text="Done")
+                    on_done(payload)
+                    return
+                elif kind == 'cancelled':
+                    self._finish_job()
+                    self.status_label.config(text="Cancelled")
+                    return
+                elif kind == 'error':
+                    self._finish_job()
+                    self.status_label.config(text="Failed")
+                    messagebox.showerror("Error", f"OCR failed: {payload}")
+                    return
+                elif on_message is not None:
+                    on_message(kind, payload)
+        except queue.Empty:
+            pass
+        self.root.after(50, self._poll_job, key, on_done, on_message)
+
+    def _finish_job(self):
+        self.job_key = None
+        self.job_messages = None
+        self._set_busy(False)
+
+    def _set_busy(self, busy):
+        state = tk.DISABLED if busy else tk.NORMAL
+        self.upload_btn.config(state=state)
+        self.process_btn.config(state=state)
+        self.handwriting_btn.config(state=state)
+        self.extract_table_btn.config(state=state)
+        self.cancel_btn.config(state=tk.NORMAL if busy else tk.DISABLED)
+        self.progress.stop()
+        if busy:
+            # indeterminate until the job reports real progress
+            self.progress.config(mode='indeterminate')
+            self.progress.start(10)
+            self.status_label.config(text="Working...")
+        else:
+            self.progress.config(mode='determinate', value=0)
+
+    def cancel_job(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            if self.job_interruptible:
+                self.status_label.config(text="Cancelling...")
+            else:
+                # tesseract can't be stopped mid-page, the result is dropped once it returns
+                self.status_label.config(text="Cancelling after the current OCR call finishes...")
+
+    # ---------- OCR actions ----------
+
     def process_handwriting_image(self):
         if not self.image_path:
             return
+        image = self.original_image
+
+        def work(post, cancelled):
+            post('status', "Loading handwriting model...")
+            lines = []
+            for done, total, texts in backend.iter_handwritten_lines(image):
+                if cancelled():
+                    raise JobCancelled()
+                lines.extend(texts)
+                post('lines', texts)
+                post('progress', (done, total))
+            return "\n".join(lines) if lines else "No handwriting detected."
+
+        def on_lines(kind, texts):
+            # show recognised lines as soon as each batch finishes
+            if kind == 'lines':
+                if self.text_area.get("1.0", tk.END).strip():
+                    self.text_area.insert(tk.END, "\n")
+                self.text_area.insert(tk.END, "\n".join(texts))
 
-        result = backend.handle_user_choice(self.image_path, 'handwritten')
-        text = result['text']
+        self.text_area.delete("1.0", tk.END)
+        self.start_job('handwritten', work, self._show_handwriting_result, on_lines)
+
+    def _show_handwriting_result(self, text):
         self.text_area.delete("1.0", tk.END)
         self.text_area.insert(tk.END, text)
 
@@ -108,10 +285,33 @@ class OCRApp:
         if not self.image_path:
             messagebox.showerror("Error", "No image to extract table from.")
             return
+        image = self.original_image
+
+        if self.table_grid_mode.get():
+            def work(post, cancelled):
+                # one page OCR placed into the ruling grid; like printed mode it can't stop mid-page
+                _, rows = extract_table_grid(image)
+                if cancelled():
+                    raise JobCancelled()
+                return rows
+
+            self.start_job('table_grid', work, self._show_table, interruptible=False)
+            return
+
+        def work(post, cancelled):
+            def progress(done, total):
+                if cancelled():
+                    raise JobCancelled()
+                post('progress', (done, total))
+            _, table_cells = extract_tables_from_image(image, progress=progress)
+            # rows from the ruling lines, not from how close the cell corners happen to be
+            row_edges, _, _ = detect_table_grid(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+            return cells_to_rows(table_cells, row_edges)
 
-        output_img, table_cells = extract_tables_from_image(self.image_path)
+        self.start_job('table', work, self._show_table)
 
-        if not table_cells:
+    def _show_table(self, rows):
+        if not rows:
             messagebox.showinfo("Info", "No tables detected.")
             return
 
@@ -122,34 +322,39 @@ class OCRApp:
         table_text = tk.Text(table_window, wrap=tk.WORD, width=80, height=25)
         table_text.pack(padx=10, pady=10)
 
-        sorted_cells = sorted(table_cells, key=lambda item: (item[0][1], item[0][0]))
-        last_y = -1000
-        for ((x, y), text) in sorted_cells:
-            if abs(y - last_y) > 15:
-                table_text.insert(tk.END, "\n")
-            table_text.insert(tk.END, text + "\t")
-            last_y = y
+        for row in rows:
+            table_text.insert(tk.END, "\t".join(cell.replace("\n", " ") for cell in row) + "\n")
 
         save_csv = messagebox.askyesno("Save Table", "Do you want to save the table as CSV?")
         if save_csv:
             from datetime import datetime
             filename = f"table_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            cells_to_csv(table_cells, filename)
+            rows_to_csv(rows, filename)
             messagebox.showinfo("Saved", f"Table saved as {filename}")
 
     def process_image(self):
         # General image preprocessing (for normal OCR)
         if not self.image_path:
             return
+        image = self.original_image
+
+        def work(post, cancelled):
+            # tesseract can't be interrupted mid-page, a cancel just drops the result
+            result = backend.process_and_extract(image)
+            if cancelled():
+                raise JobCancelled()
+            return result
 
-        gray, processed, _, text = backend.process_and_extract(self.image_path)
+        self.start_job('printed', work, self._show_printed_result, interruptible=False)
+
+    def _show_printed_result(self, result):
+        gray, processed, _, text = result
 
         if processed is not None:
             self.gray_image = gray
             self.processed_image = processed
 
-            cv2.imwrite("processed_output.png", processed)
-            self.display_image("processed_output.png", self.proc_img_display)
+            self.display_image(processed, self.proc_img_display)
 
             self.text_area.delete("1.0", tk.END)
             self.text_area.insert(tk.END, text)
@@ -158,18 +363,19 @@ class OCRApp:
             self.copy_text_btn.config(state=tk.NORMAL)
             self.save_img_btn.config(state=tk.NORMAL)
             self.save_pdf_btn.config(state=tk.NORMAL)
-            self.save_text_btn.config(state=tk.NORMAL)
-            self.copy_text_btn.config(state=tk.NORMAL)
-            self.save_img_btn.config(state=tk.NORMAL)
-            self.save_pdf_btn.config(state=tk.NORMAL)
         else:
             messagebox.showerror("Error", "Could not process the image.")
 
-    def display_image(self, path, label):
-        # Display an image in a Tkinter label
-        img = Image.open(path)
-        img.thumbnail((400, 400))
-        img = ImageTk.PhotoImage(img)
+    def display_image(self, image, label):
+        # Display a BGR / grayscale array in a Tkinter label, shrinking it before the colour conversion
+        height, width = image.shape[:2]
+        scale = min(400 / width, 400 / height, 1.0)
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        img = ImageTk.PhotoImage(Image.fromarray(image))
         label.config(image=img)
         label.image = img  # Keep a reference
 
@@ -202,6 +408,11 @@ class OCRApp:
         if not file_path:
             return
 
+        # reportlab is only needed here, keep it out of the startup imports
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.utils import simpleSplit
+
         c = canvas.Canvas(file_path, pagesize=letter)
         width, height = letter
 
@@ -0,0 +1,139 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# TrOCR handwriting recognition. torch / transformers are only imported when
+# the model is first needed, printed-text runs never pay for them.
+TROCR_MODEL = os.environ.get('TROCR_MODEL', 'microsoft/trocr-base-handwritten')
+DEFAULT_BATCH_SIZE = int(os.environ.get('TROCR_BATCH_SIZE', '16'))
+
+
+class TrOCREngine:
+    """
+    TrOCR processor + model loaded once, recognising line crops in batches.
+
+    batch_size  -- line crops per forward pass
+    num_threads -- torch intra-op threads (None keeps torch's default)
+    quantize    -- int8 dynamic quantization of the Linear layers (CPU only)
+    """
+
+    def __init__(self, model_name=TROCR_MODEL, batch_size=DEFAULT_BATCH_SIZE, num_threads=None, quantize=False):
+        import torch
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.torch = torch
+        self.batch_size = batch_size
+        self.processor = TrOCRProcessor.from_pretrained(model_name)
+        model = VisionEncoderDecoderModel.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self._set_input_params()
+        # one generate() at a time, parallel calls would just fight over the torch threads
+        self._lock = threading.Lock()
+
+    def _set_input_params(self):
+        # resize / normalisation settings of the model's image processor
+        image_processor = getattr(self.processor, 'image_processor', None) or self.processor.feature_extractor
+        size = image_processor.size
+        if isinstance(size, dict):
+            self.input_size = (size.get('height', 384), size.get('width', 384))
+        else:
+            self.input_size = (size, size)
+        mean = np.asarray(image_processor.image_mean, np.float32)
+        std = np.asarray(image_processor.image_std, np.float32)
+        rescale = getattr(image_processor, 'rescale_factor', 1 / 255)
+        # (x * rescale - mean) / std folded into one multiply-add per channel
+        self._scale = rescale / std
+        self._shift = -mean / std
+
+    def prepare_batch(self, crops):
+        """
+        Resize every crop straight into one (N, H, W, 3) uint8 stack, then
+        normalise the whole stack at once into the float32 NCHW array the
+        encoder takes.
+        """
+        height, width = self.input_size
+        stack = np.empty((len(crops), height, width, 3), np.uint8)
+        for i, crop in enumerate(crops):
+            if not isinstance(crop, np.ndarray):
+                # PIL: palette, RGBA, 16-bit ... all become plain RGB
+                crop = np.asarray(crop.convert('RGB'))
+            if crop.ndim == 2 or crop.shape[2] == 1:
+                crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2RGB)
+            elif crop.shape[2] == 4:
+                crop = cv2.cvtColor(crop, cv2.COLOR_RGBA2RGB)
+            # assigned rather than resized into dst=, which OpenCV silently reallocates on any mismatch
+            stack[i] = cv2.resize(crop, (width, height), interpolation=cv2.INTER_LINEAR)
+        batch = stack.astype(np.float32)
+        batch *= self._scale
+        batch += self._shift
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+    def recognize(self, crops):
+        """
+        crops: list of RGB line images (numpy arrays or PIL images).
+        Returns one string per crop, in the same order.
+        """
+        if not crops:
+            return []
+
+        # crops of similar width usually hold similar amounts of text, so sorting
+        # by width keeps generate() from decoding a long tail for one line in the batch
+        order = sorted(range(len(crops)), key=lambda i: _width(crops[i]))
+        texts = [None] * len(crops)
+
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch = [crops[i] for i in batch_ids]
+            pixel_values = self.torch.from_numpy(self.prepare_batch(batch))
+            with self._lock, self.torch.inference_mode():
+                generated_ids = self.model.generate(pixel_values)
+            decoded = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+            for i, text in zip(batch_ids, decoded):
+                texts[i] = text.strip()
+
+        return texts
+
+    def recognize_pages(self, pages):
+        """
+        pages: list of crop lists, one per page. All crops are batched together
+        and the texts are split back per page.
+        """
+        flat = [crop for crops in pages for crop in crops]
+        texts = self.recognize(flat)
+        result, offset = [], 0
+        for crops in pages:
+            result.append(texts[offset:offset + len(crops)])
+            offset += len(crops)
+        return result
+
+
+def _width(crop):
+    return crop.shape[1] if hasattr(crop, 'shape') else crop.size[0]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_trocr_engine():
+    """
+    The process-wide TrOCR engine, created on first use. Settings come from
+    TROCR_MODEL, TROCR_BATCH_SIZE, TROCR_THREADS and TROCR_QUANTIZE=1.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                threads = os.environ.get('TROCR_THREADS')
+                _engine = TrOCREngine(batch_size=DEFAULT_BATCH_SIZE,
+                                      num_threads=int(threads) if threads else None,
+                                      quantize=os.environ.get('TROCR_QUANTIZE') == '1')
+    return _engine
@@ -0,0 +1,202 @@
+"""
+Lightweight timing spans for the OCR pipeline.
+
+    from instrumentation import span
+
+    with span('clahe', width=w, height=h) as s:
+        ...
+        s.set(lines=len(lines))
+
+Tracing is off by default and span() then hands back a shared no-op object,
+so instrumented code costs one function call per stage. Turn it on with
+enable(sink, ...) or from the environment:
+
+    OCR_TRACE=1                 keep the last records in an in-memory ring buffer
+    OCR_TRACE_JSONL=trace.jsonl append every record to a JSONL file
+"""
+import os
+import json
+import time
+import cProfile
+import pstats
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+_enabled = False
+_sinks = []
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('stage', 'fields', 'start')
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+        self.start = 0.0
+
+    def set(self, **fields):
+        """Attach more fields (line count, cache hit, ...) to the record."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        record = {'stage': self.stage, 'duration_ms': duration * 1000, 'ts': time.time()}
+        record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        for sink in _sinks:
+            sink.write(record)
+        return False
+
+
+def span(stage, **fields):
+    """Context manager timing one pipeline stage."""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(stage, fields)
+
+
+def enable(*sinks):
+    """Start recording spans into the given sinks (a RingBufferSink if none given)."""
+    global _enabled
+    _sinks.extend(sinks or [RingBufferSink()])
+    _enabled = True
+    return _sinks
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    for sink in _sinks:
+        sink.close()
+    del _sinks[:]
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_sinks():
+    return list(_sinks)
+
+
+class RingBufferSink:
+    """Keeps the last maxlen records in memory."""
+
+    def __init__(self, maxlen=10000):
+        self._records = deque(maxlen=maxlen)
+
+    def write(self, record):
+        self._records.append(record)
+
+    def records(self):
+        return list(self._records)
+
+    def close(self):
+        pass
+
+
+class JSONLSink:
+    """Appends one JSON line per record to path."""
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusSink:
+    """
+    Aggregates span durations per stage into a histogram and renders it in the
+    Prometheus text exposition format with dump().
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name='ocr_stage_duration_seconds'):
+        self.name = name
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        seconds = record['duration_ms'] / 1000
+        with self._lock:
+            stats = self._stages.setdefault(record['stage'], {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.BUCKETS)})
+            stats['count'] += 1
+            stats['sum'] += seconds
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+
+    def dump(self):
+        lines = [f"# HELP {self.name} Time spent in each OCR pipeline stage.",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for stage, stats in sorted(self._stages.items()):
+                for bound, count in zip(self.BUCKETS, stats['buckets']):
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def profile(output_path=None, sort='cumulative', limit=30):
+    """
+    Run the enclosed block under cProfile. Stats are written to output_path
+    (loadable with pstats / snakeviz) or printed when no path is given.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+        else:
+            pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+
+
+def _configure_from_env():
+    sinks = []
+    if os.environ.get('OCR_TRACE') == '1':
+        sinks.append(RingBufferSink())
+    if os.environ.get('OCR_TRACE_JSONL'):
+        sinks.append(JSONLSink(os.environ['OCR_TRACE_JSONL']))
+    if sinks:
+        enable(*sinks)
+
+
+_configure_from_env()
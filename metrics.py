@@ -0,0 +1,409 @@
+import numpy as np
+
+# Placeholder used in alignments for an inserted / deleted symbol
+GAP = ''
+
+# backtrace codes stored per DP cell
+_DIAG, _DELETE, _INSERT = 0, 1, 2
+
+
+class Alignment:
+    """
+    Result of aligning a reference against a hypothesis.
+    pairs is a list of (ref_symbol, hyp_symbol) with GAP on the missing side.
+    """
+
+    def __init__(self, distance, pairs):
+        self.distance = distance
+        self.pairs = pairs
+
+    @property
+    def matches(self):
+        return sum(1 for r, h in self.pairs if r == h)
+
+    @property
+    def substitutions(self):
+        return sum(1 for r, h in self.pairs if r != h and r != GAP and h != GAP)
+
+    @property
+    def deletions(self):
+        return sum(1 for r, h in self.pairs if h == GAP and r != GAP)
+
+    @property
+    def insertions(self):
+        return sum(1 for r, h in self.pairs if r == GAP and h != GAP)
+
+    def __repr__(self):
+        return f"Alignment(distance={self.distance}, pairs={len(self.pairs)})"
+
+
+def _common_affixes(a, b):
+    # matching prefix/suffix never changes the edit distance, so it can be cut off up front
+    limit = min(len(a), len(b))
+    start = 0
+    while start < limit and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < limit - start and a[len(a) - 1 - end] == b[len(b) - 1 - end]:
+        end += 1
+    return start, end
+
+
+def edit_distance(ref, hyp, max_distance=None):
+    """
+    Levenshtein distance between two strings (or two lists of words) using
+    Myers' bit-parallel algorithm, with python ints as the bit vectors.
+
+    If max_distance is given the computation stops as soon as the distance is
+    known to exceed it, and max_distance + 1 is returned.
+    """
+    if max_distance is not None and abs(len(ref) - len(hyp)) > max_distance:
+        return max_distance + 1
+
+    start, end = _common_affixes(ref, hyp)
+    ref = ref[start:len(ref) - end]
+    hyp = hyp[start:len(hyp) - end]
+    if not ref or not hyp:
+        return len(ref) + len(hyp)
+
+    m = len(ref)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+
+    # peq[symbol] = bitmask of the positions of symbol in ref
+    peq = {}
+    for i, symbol in enumerate(ref):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+
+    pv, mv, score = mask, 0, m
+    remaining = len(hyp)
+    for symbol in hyp:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+
+        remaining -= 1
+        # each remaining hyp symbol can lower the score by at most one
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+
+    if max_distance is not None and score > max_distance:
+        return max_distance + 1
+    return score
+
+
+def _encode(ref, hyp):
+    if isinstance(ref, str) and isinstance(hyp, str):
+        return (np.frombuffer(ref.encode('utf-32-le'), dtype=np.uint32),
+                np.frombuffer(hyp.encode('utf-32-le'), dtype=np.uint32))
+    codes = {}
+    ref_codes = np.fromiter((codes.setdefault(s, len(codes)) for s in ref), dtype=np.int64, count=len(ref))
+    hyp_codes = np.fromiter((codes.setdefault(s, len(codes)) for s in hyp), dtype=np.int64, count=len(hyp))
+    return ref_codes, hyp_codes
+
+
+def _align_core(ref, hyp, max_distance):
+    # Row-vectorized DP: one numpy pass per ref symbol over the whole hyp row.
+    # Insertions inside a row are a running minimum of (row[j] - j), which
+    # np.minimum.accumulate does in one shot.
+    n, m = len(ref), len(hyp)
+    ref_codes, hyp_codes = _encode(ref, hyp)
+    steps = np.arange(m + 1, dtype=np.int32)
+    ops = np.empty((n, m), dtype=np.uint8)
+
+    prev = steps.copy()
+    row = np.empty(m + 1, dtype=np.int32)
+    for i in range(1, n + 1):
+        diag = prev[:-1] + (hyp_codes != ref_codes[i - 1])
+        up = prev[1:] + 1
+        row[0] = i
+        np.minimum(diag, up, out=row[1:])
+        row -= steps
+        np.minimum.accumulate(row, out=row)
+        row += steps
+
+        cells = row[1:]
+        ops[i - 1] = np.where(cells == diag, _DIAG, np.where(cells == up, _DELETE, _INSERT))
+
+        if max_distance is not None and row.min() > max_distance:
+            return None
+        prev, row = row, prev
+
+    distance = int(prev[m])
+    if max_distance is not None and distance > max_distance:
+        return None
+
+    pairs = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        op = ops[i - 1, j - 1] if i > 0 and j > 0 else (_DELETE if i > 0 else _INSERT)
+        if op == _DIAG:
+            pairs.append((ref[i - 1], hyp[j - 1]))
+            i -= 1
+            j -= 1
+        elif op == _DELETE:
+            pairs.append((ref[i - 1], GAP))
+            i -= 1
+        else:
+            pairs.append((GAP, hyp[j - 1]))
+            j -= 1
+    pairs.reverse()
+    return distance, pairs
+
+
+def align(ref, hyp, max_distance=None):
+    """
+    Optimal Levenshtein alignment of hyp against ref (strings or word lists).
+    Returns an Alignment, or None when the distance exceeds max_distance.
+    """
+    if max_distance is not None and abs(len(ref) - len(hyp)) > max_distance:
+        return None
+
+    start, end = _common_affixes(ref, hyp)
+    head = [(s, s) for s in ref[:start]]
+    tail = [(s, s) for s in ref[len(ref) - end:]] if end else []
+    ref_mid = ref[start:len(ref) - end]
+    hyp_mid = hyp[start:len(hyp) - end]
+
+    if not ref_mid or not hyp_mid:
+        distance = len(ref_mid) + len(hyp_mid)
+        middle = [(s, GAP) for s in ref_mid] + [(GAP, s) for s in hyp_mid]
+    elif len(ref_mid) > len(hyp_mid):
+        # loop over the shorter side, vectorize over the longer one
+        core = _align_core(hyp_mid, ref_mid, max_distance)
+        if core is None:
+            return None
+        distance, swapped = core
+        middle = [(r, h) for h, r in swapped]
+    else:
+        core = _align_core(ref_mid, hyp_mid, max_distance)
+        if core is None:
+            return None
+        distance, middle = core
+
+    return Alignment(distance, head + middle + tail)
+
+
+def char_error_rate(ref, hyp):
+    return edit_distance(ref, hyp) / len(ref) if ref else float(bool(hyp))
+
+
+def word_error_rate(ref, hyp):
+    ref_words, hyp_words = ref.split(), hyp.split()
+    return edit_distance(ref_words, hyp_words) / len(ref_words) if ref_words else float(bool(hyp_words))
+
+
+def confusion_pairs(alignment):
+    """(true, predicted) character pairs from an alignment, minus whitespace-only pairs."""
+    return [(r, h) for r, h in alignment.pairs if r.strip() != '' or h.strip() != '']
+
+
+# GAP packs like a code point, just outside the Unicode range
+_GAP_CODE = 0x110000
+_CODE_BITS = 21
+_CODE_MASK = (1 << _CODE_BITS) - 1
+
+
+def _char_codes(chars):
+    return np.fromiter((ord(c) if c else _GAP_CODE for c in chars), dtype=np.int64, count=len(chars))
+
+
+def _char_label(code):
+    return GAP if code == _GAP_CODE else chr(code)
+
+
+class SparseConfusion:
+    """
+    Character confusion counts for the whole Unicode range. Every (true,
+    predicted) pair is packed into one int64 key; the counts are kept as two
+    sorted arrays (keys, counts). New pairs are buffered and folded in with one
+    sort every flush_every pairs, so memory grows with the number of distinct
+    pairs seen, not with the number of characters scored.
+    """
+
+    def __init__(self, flush_every=65536):
+        self.flush_every = flush_every
+        self._keys = np.empty(0, np.int64)
+        self._counts = np.empty(0, np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def add_pairs(self, pairs):
+        if not pairs:
+            return
+        true = _char_codes([t for t, _ in pairs])
+        pred = _char_codes([p for _, p in pairs])
+        self._add((true << _CODE_BITS) | pred, np.ones(len(pairs), np.int64))
+
+    def _add(self, keys, counts):
+        self._pending.append((keys, counts))
+        self._pending_size += keys.size
+        if self._pending_size >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self._keys] + [k for k, _ in self._pending])
+        counts = np.concatenate([self._counts] + [c for _, c in self._pending])
+        self._pending, self._pending_size = [], 0
+        order = np.argsort(keys, kind='stable')
+        keys, counts = keys[order], counts[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        self._keys = keys[starts]
+        self._counts = np.add.reduceat(counts, starts) if starts.size else counts
+
+    def merge(self, other):
+        other._flush()
+        self._add(other._keys.copy(), other._counts.copy())
+        self._flush()
+        return self
+
+    def entries(self):
+        """(true codes, predicted codes, counts) of every distinct pair."""
+        self._flush()
+        return self._keys >> _CODE_BITS, self._keys & _CODE_MASK, self._counts
+
+    @property
+    def total(self):
+        self._flush()
+        return int(self._counts.sum())
+
+    @property
+    def correct(self):
+        true, pred, counts = self.entries()
+        return int(counts[true == pred].sum())
+
+    def top_pairs(self, k=20):
+        """The k most frequent confusions as (true, predicted, count), GAP marking insertions / deletions."""
+        true, pred, counts = self.entries()
+        wrong = np.flatnonzero(true != pred)
+        top = wrong[np.argsort(-counts[wrong], kind='stable')[:k]]
+        return [(_char_label(true[i]), _char_label(pred[i]), int(counts[i])) for i in top]
+
+    def per_char(self):
+        """
+        Per-character scores, one row per character seen in the ground truth or
+        the predictions: {'chars', 'support', 'predicted', 'correct',
+        'precision', 'recall', 'f1'}, arrays ordered by support (descending).
+        """
+        true, pred, counts = self.entries()
+        codes = np.unique(np.concatenate((true, pred)))
+        codes = codes[codes != _GAP_CODE]
+        support = np.zeros(codes.size, np.int64)
+        predicted = np.zeros(codes.size, np.int64)
+        correct = np.zeros(codes.size, np.int64)
+        real_true, real_pred = true != _GAP_CODE, pred != _GAP_CODE
+        np.add.at(support, np.searchsorted(codes, true[real_true]), counts[real_true])
+        np.add.at(predicted, np.searchsorted(codes, pred[real_pred]), counts[real_pred])
+        same = true == pred
+        np.add.at(correct, np.searchsorted(codes, true[same]), counts[same])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, correct / predicted, 0.0)
+            recall = np.where(support > 0, correct / support, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        order = np.lexsort((codes, -support))
+        return {
+            'chars': [chr(c) for c in codes[order]],
+            'support': support[order],
+            'predicted': predicted[order],
+            'correct': correct[order],
+            'precision': precision[order],
+            'recall': recall[order],
+            'f1': f1[order],
+        }
+
+    def matrix(self, chars=None):
+        """
+        Dense (labels, matrix) over the given characters (default: the ground
+        truth characters), rows true and columns predicted. Only meant for
+        small views; the full structure stays sparse.
+        """
+        true, pred, counts = self.entries()
+        codes = np.unique(true) if chars is None else _char_codes(list(chars))
+        if chars is None:
+            codes = codes[np.argsort([_char_label(c) for c in codes], kind='stable')]
+        index = {int(c): i for i, c in enumerate(codes)}
+        matrix = np.zeros((codes.size, codes.size), np.int64)
+        rows = np.array([index.get(int(c), -1) for c in true], np.intp)
+        cols = np.array([index.get(int(c), -1) for c in pred], np.intp)
+        keep = (rows >= 0) & (cols >= 0)
+        np.add.at(matrix, (rows[keep], cols[keep]), counts[keep])
+        return [_char_label(c) for c in codes], matrix
+
+
+class MetricsAccumulator:
+    """
+    Running OCR metrics over many (prediction, ground truth) pairs: integer
+    counters plus a sparse character confusion structure. Memory grows only
+    with the distinct character pairs seen, and accumulators built in
+    different workers can be combined with merge().
+    """
+
+    def __init__(self):
+        self.confusion = SparseConfusion()
+        self.images = 0
+        self.correct_words = 0
+        self.total_chars = 0
+        self.correct_chars = 0
+        self.edit_distance = 0
+        self.word_errors = 0
+        self.total_words = 0
+
+    def update(self, pred, gt):
+        """Score one image. Returns the character alignment of pred against gt."""
+        alignment = align(gt, pred)
+        self.add_scored(pred, gt, alignment, edit_distance(gt.split(), pred.split()))
+        return alignment
+
+    def add_scored(self, pred, gt, alignment, word_errors):
+        """Count an image that the caller already aligned, so it isn't aligned a second time."""
+        self.images += 1
+        self.correct_words += pred == gt
+        self.total_chars += len(gt)
+        self.correct_chars += alignment.matches
+        self.edit_distance += alignment.distance
+
+        self.word_errors += word_errors
+        self.total_words += len(gt.split())
+
+        self.confusion.add_pairs(confusion_pairs(alignment))
+
+    def merge(self, other):
+        """Add another accumulator's counts into this one."""
+        for name in ('images', 'correct_words', 'total_chars', 'correct_chars',
+                     'edit_distance', 'word_errors', 'total_words'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.confusion.merge(other.confusion)
+        return self
+
+    @property
+    def char_pairs(self):
+        return self.confusion.total
+
+    @property
+    def micro_precision(self):
+        # single-label per aligned pair, so micro precision == recall == F1 == pair accuracy
+        total = self.char_pairs
+        return self.confusion.correct / total if total else 0.0
+
+    def top_confusions(self, k=20):
+        return self.confusion.top_pairs(k)
+
+    def per_char_scores(self):
+        return self.confusion.per_char()
+
+    def confusion_matrix(self, chars=None):
+        """(labels, matrix) restricted to the characters that occur in the ground truth, or to chars."""
+        return self.confusion.matrix(chars)
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import multiprocessing.util
+
+import numpy as np
+
+# OCR results are stored in a small SQLite file, keyed by content hashes
+DEFAULT_CACHE_PATH = os.path.join('.ocr_cache', 'ocr_cache.sqlite')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# lookups only touch memory; their LRU timestamps and counters are written this many at a time
+TOUCH_BATCH = 64
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_array(array):
+    # shape and dtype are part of the key, otherwise a reshaped image would collide
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(f"{array.shape}|{array.dtype.str}|".encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Combine content hashes and pipeline settings into one cache key."""
+    return hash_bytes(json.dumps(parts, sort_keys=True, default=str).encode())
+
+
+class OCRCache:
+    """
+    Content-addressed key/value store on local disk with size-bounded LRU
+    eviction. Values must be JSON serialisable (OCR text, word boxes, ...).
+    Safe to share between threads and worker processes: every thread opens its
+    own SQLite connection.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._counts = {'hits': 0, 'misses': 0}
+        self._pid = None
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                     "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                     "size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+        # running total of the value sizes, so a put doesn't have to SUM the whole table
+        conn.execute("INSERT OR IGNORE INTO counters SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker starts without the parent's pending counts, and gets its own
+                # exit hook: pool workers leave through os._exit, which only runs multiprocessing finalizers
+                self._pid = os.getpid()
+                self._touched, self._counts = {}, {'hits': 0, 'misses': 0}
+                multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+        return conn
+
+    def _bump(self, conn, name, amount=1):
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get(self, key):
+        """Return the cached value, or None on a miss. Hits and misses are written out in batches."""
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._counts['misses'] += 1
+            else:
+                self._counts['hits'] += 1
+                self._touched[key] = time.time()
+            full = sum(self._counts.values()) >= TOUCH_BATCH
+        if full:
+            self.flush()
+        return json.loads(row[0]) if row is not None else None
+
+    def flush(self):
+        """Write the pending LRU timestamps and hit / miss counts."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            counts, self._counts = self._counts, {'hits': 0, 'misses': 0}
+        if not touched and not any(counts.values()):
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                             [(when, key) for key, when in touched.items()])
+            for name, amount in counts.items():
+                self._bump(conn, name, amount)
+
+    def put(self, key, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode())
+        conn = self._connect()
+        with conn:
+            # IMMEDIATE: the old size and the new total must not race with another process
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, payload, size, time.time()))
+            self._bump(conn, 'bytes', size - (old[0] if old else 0))
+        self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # recent hits must count before picking the least recently used entries
+        self.flush()
+        excess = total - self.max_bytes
+        victims = []
+        freed = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            freed = 0
+            for (key,) in victims:
+                row = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    freed += row[0]
+            self._bump(conn, 'bytes', -freed)
+            self._bump(conn, 'evictions', len(victims))
+
+    def stats(self):
+        self.flush()
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT name, value FROM counters"))
+        stats['entries'] = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._touched, self._counts = {}, {'hits': 0, 'misses': 0}
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE counters SET value = 0")
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Shared cache instance, or None when caching is turned off with OCR_CACHE=0.
+    OCR_CACHE_PATH and OCR_CACHE_MAX_MB override the location and size limit.
+    """
+    global _cache
+    if os.environ.get('OCR_CACHE', '1') == '0':
+        return None
+    if _cache is None:
+        max_mb = os.environ.get('OCR_CACHE_MAX_MB')
+        _cache = OCRCache(os.environ.get('OCR_CACHE_PATH', DEFAULT_CACHE_PATH),
+                          int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES)
+    return _cache
@@ -0,0 +1,207 @@
+"""
+Columnar store for evaluation runs.
+
+    python test_model.py --store runs/psm6.npz            # evaluate and keep the run
+    python results_store.py rescore runs/psm6.npz         # metrics + slices, no OCR
+    python results_store.py diff runs/psm6.npz runs/psm7.npz
+
+A run is one compressed .npz file: one NumPy column per field (filename,
+prediction, ground truth, timings, per-image metric counts) plus a JSON blob
+with the settings the run was made with. Re-scoring and diffing only read
+the stored predictions, so comparing two configurations takes milliseconds.
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from metrics import align, edit_distance
+
+TEXT_COLUMNS = ('filename', 'predicted', 'ground_truth', 'stages')
+METRIC_COLUMNS = ('distance', 'matches', 'gt_chars', 'word_errors', 'gt_words', 'exact')
+
+# ground truth length buckets for the sliced report: [low, high)
+LENGTH_BUCKETS = ((0, 4), (4, 8), (8, 16), (16, None))
+
+
+def score_columns(predicted, ground_truth, stats=None):
+    """
+    Per-image metric counts (the METRIC_COLUMNS) for two aligned text columns.
+    A metrics.MetricsAccumulator passed as stats is fed from the same alignments.
+    """
+    n = len(predicted)
+    scores = {name: np.zeros(n, np.int32) for name in METRIC_COLUMNS}
+    for i, (pred, gt) in enumerate(zip(predicted, ground_truth)):
+        pred, gt = str(pred), str(gt)
+        alignment = align(gt, pred)
+        gt_words = gt.split()
+        word_errors = edit_distance(gt_words, pred.split())
+        if stats is not None:
+            stats.add_scored(pred, gt, alignment, word_errors)
+        scores['distance'][i] = alignment.distance
+        scores['matches'][i] = alignment.matches
+        scores['gt_chars'][i] = len(gt)
+        scores['word_errors'][i] = word_errors
+        scores['gt_words'][i] = len(gt_words)
+        scores['exact'][i] = pred == gt
+    scores['exact'] = scores['exact'].astype(bool)
+    return scores
+
+
+def build_columns(records, stats=None):
+    """Columns for the 'ok' records of an evaluation run (test_model record dicts); stats as in score_columns."""
+    records = [r for r in records if r.get('status') == 'ok']
+    columns = {
+        'filename': np.array([r['filename'] for r in records], dtype=str),
+        'predicted': np.array([r['predicted'] for r in records], dtype=str),
+        'ground_truth': np.array([r['ground_truth'] for r in records], dtype=str),
+        'stages': np.array([','.join(r.get('stages', ())) for r in records], dtype=str),
+        'preprocess_s': np.array([r['timings']['preprocess'] for r in records], np.float32),
+        'ocr_s': np.array([r['timings']['ocr'] for r in records], np.float32),
+        'cached': np.array([bool(r.get('cached')) for r in records], bool),
+    }
+    columns.update(score_columns(columns['predicted'], columns['ground_truth'], stats))
+    return columns
+
+
+def save_run(path, columns, meta=None):
+    meta = dict(meta or {})
+    meta.setdefault('created', time.strftime('%Y-%m-%d %H:%M:%S'))
+    np.savez_compressed(path, __meta__=np.array(json.dumps(meta)), **columns)
+
+
+def load_run(path):
+    """Returns (columns, meta)."""
+    with np.load(path, allow_pickle=False) as data:
+        columns = {name: data[name] for name in data.files if name != '__meta__'}
+        meta = json.loads(str(data['__meta__'])) if '__meta__' in data.files else {}
+    return columns, meta
+
+
+def summarize(columns, mask=None):
+    """Aggregate metrics over all images, or over the images selected by a boolean mask."""
+    if mask is None:
+        mask = np.ones(len(columns['filename']), bool)
+    images = int(mask.sum())
+    total = lambda name: int(columns[name][mask].sum())
+    gt_chars, gt_words = total('gt_chars'), total('gt_words')
+    # cache hits never ran the pipeline, they'd pull the latency down
+    timed = mask & ~columns['cached']
+    return {
+        'images': images,
+        'word_accuracy': total('exact') / images * 100 if images else 0.0,
+        'char_accuracy': total('matches') / gt_chars * 100 if gt_chars else 0.0,
+        'cer': total('distance') / gt_chars * 100 if gt_chars else 0.0,
+        'wer': total('word_errors') / gt_words * 100 if gt_words else 0.0,
+        'avg_levenshtein': total('distance') / images if images else 0.0,
+        'preprocess_ms': float(columns['preprocess_s'][timed].mean() * 1000) if timed.any() else 0.0,
+        'ocr_ms': float(columns['ocr_s'][timed].mean() * 1000) if timed.any() else 0.0,
+    }
+
+
+def slices(columns):
+    """{slice name: summary} by ground truth length and, for adaptive runs, by stage plan."""
+    result = {}
+    lengths = np.char.str_len(columns['ground_truth'])
+    for low, high in LENGTH_BUCKETS:
+        mask = lengths >= low if high is None else (lengths >= low) & (lengths < high)
+        if mask.any():
+            name = f"gt_len {low}+" if high is None else f"gt_len {low}-{high - 1}"
+            result[name] = summarize(columns, mask)
+    for plan in np.unique(columns['stages']):
+        if plan:
+            result[f"stages {plan}"] = summarize(columns, columns['stages'] == plan)
+    return result
+
+
+def diff(base, new):
+    """
+    Compare two runs on the images they share. Returns a dict with both
+    summaries, the filenames that got fixed / broken, and the ones whose
+    prediction changed.
+    """
+    _, bi, ni = np.intersect1d(base['filename'], new['filename'], return_indices=True)
+    shared = len(bi)
+    base_sub = {name: column[bi] for name, column in base.items()}
+    new_sub = {name: column[ni] for name, column in new.items()}
+    changed = base_sub['predicted'] != new_sub['predicted']
+    return {
+        'shared_images': shared,
+        'only_in_base': len(base['filename']) - shared,
+        'only_in_new': len(new['filename']) - shared,
+        'base': summarize(base_sub),
+        'new': summarize(new_sub),
+        'fixed': base_sub['filename'][~base_sub['exact'] & new_sub['exact']].tolist(),
+        'broken': base_sub['filename'][base_sub['exact'] & ~new_sub['exact']].tolist(),
+        'changed': [(str(f), str(b), str(n)) for f, b, n in zip(base_sub['filename'][changed],
+                                                                base_sub['predicted'][changed],
+                                                                new_sub['predicted'][changed])],
+    }
+
+
+SUMMARY_FIELDS = (('images', '{:.0f}'), ('word_accuracy', '{:.2f}%'), ('char_accuracy', '{:.2f}%'),
+                  ('cer', '{:.2f}%'), ('wer', '{:.2f}%'), ('avg_levenshtein', '{:.2f}'),
+                  ('preprocess_ms', '{:.2f}'), ('ocr_ms', '{:.2f}'))
+
+
+def print_summary(summary, title):
+    print(f"\n{title}")
+    for name, fmt in SUMMARY_FIELDS:
+        print(f"  {name:18} {fmt.format(summary[name])}")
+
+
+def _rescore_command(args):
+    columns, meta = load_run(args.run)
+    # recompute the metric columns from the stored texts, metric code may have changed since the run
+    columns.update(score_columns(columns['predicted'], columns['ground_truth']))
+    print(f"Run {args.run} ({meta.get('created', 'unknown date')})")
+    for key, value in meta.items():
+        if key != 'created':
+            print(f"  {key}: {value}")
+    print_summary(summarize(columns), "All images")
+    print(f"\n{'slice':40} {'n':>5} {'word acc':>9} {'CER':>8} {'WER':>8}")
+    for name, s in slices(columns).items():
+        print(f"{name:40} {s['images']:>5} {s['word_accuracy']:>8.2f}% {s['cer']:>7.2f}% {s['wer']:>7.2f}%")
+    if args.save:
+        save_run(args.save, columns, meta)
+        print(f"\nRe-scored run saved to {args.save}")
+
+
+def _diff_command(args):
+    base, _ = load_run(args.base)
+    new, _ = load_run(args.new)
+    result = diff(base, new)
+    print(f"{result['shared_images']} shared images "
+          f"({result['only_in_base']} only in base, {result['only_in_new']} only in new)")
+    print(f"\n{'metric':18} {'base':>10} {'new':>10} {'change':>10}")
+    for name, _ in SUMMARY_FIELDS[1:]:
+        old, now = result['base'][name], result['new'][name]
+        print(f"{name:18} {old:>10.2f} {now:>10.2f} {now - old:>+10.2f}")
+    print(f"\nFixed: {len(result['fixed'])}, broken: {len(result['broken'])}, "
+          f"changed predictions: {len(result['changed'])}")
+    for filename, old, now in result['changed'][:args.show]:
+        print(f"  {filename}: {old!r} -> {now!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score and compare stored evaluation runs without running OCR")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rescore = commands.add_parser('rescore', help="metrics and slices of one stored run")
+    rescore.add_argument('run')
+    rescore.add_argument('--save', help="write the run with recomputed metric columns here")
+    rescore.set_defaults(func=_rescore_command)
+
+    compare = commands.add_parser('diff', help="compare two stored runs image by image")
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--show', type=int, default=20, help="changed predictions to print")
+    compare.set_defaults(func=_diff_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
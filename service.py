@@ -0,0 +1,353 @@
+"""
+Headless HTTP OCR service.
+
+    python service.py --port 8000 --workers 4
+
+    curl --data-binary @pic1.png http://127.0.0.1:8000/ocr/printed
+    curl --data-binary @hw1.png  http://127.0.0.1:8000/ocr/handwritten
+    curl --data-binary @pic1.png http://127.0.0.1:8000/ocr/table
+    curl --data-binary @pic1.png http://127.0.0.1:8000/ocr/auto
+
+The request body is the raw image file. Requests wait in a bounded queue; when
+it is full the service answers 503 with Retry-After instead of piling up work.
+Tesseract / preprocessing / line segmentation run in a process pool, and
+handwritten line crops from concurrent requests are micro-batched into shared
+TrOCR forward passes in this process. /ocr/auto runs tesseract in the pool and
+sends only its low-confidence lines through the same TrOCR batches.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import backend
+import instrumentation
+from table_extractor import extract_tables_from_image
+
+MAX_BODY_BYTES = 32 * 1024 * 1024
+# how long a rejected oversized request head is read and dropped before the connection closes
+LINGER_SECONDS = 1.0
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+               503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+# --- process pool jobs, kept at module level so they can be pickled ---
+
+def _init_worker():
+    # one pool process per core already, keep tesseract single threaded
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def _decode(data):
+    image = backend.load_image(data)
+    if image is None:
+        raise ValueError("could not decode image")
+    return image
+
+
+def _ocr_printed(data):
+    # the raw bytes go in so the cache key stays the hash of the upload; a hit skips preprocessing
+    _, _, original, text = backend.process_and_extract(data, images=False)
+    if original is None:
+        raise ValueError("could not decode image")
+    return {'text': text}
+
+
+def _ocr_table(data):
+    _, cells = extract_tables_from_image(_decode(data))
+    return {'cells': [{'x': x, 'y': y, 'text': text} for (x, y), text in cells]}
+
+
+def _segment_handwritten(data):
+    return backend.handwritten_line_crops(_decode(data))
+
+
+def _cascade_first_pass(data):
+    original, lines, escalate, crops = backend.cascade_first_pass(data)
+    if original is None:
+        raise ValueError("could not decode image")
+    return {'lines': lines, 'escalate': escalate, 'crops': crops}
+
+
+class JobError(Exception):
+    """A pool job failed; carries the original error as text."""
+
+
+JOBS = {'printed': _ocr_printed, 'table': _ocr_table, 'handwritten': _segment_handwritten,
+        'auto': _cascade_first_pass}
+
+
+def _run_job(kind, data):
+    # some library exceptions (e.g. TesseractNotFoundError) can't be unpickled
+    # and would break the whole pool, so only plain exceptions cross the process boundary
+    try:
+        return JOBS[kind](data)
+    except ValueError as e:
+        raise ValueError(str(e)) from None
+    except Exception as e:
+        raise JobError(f"{type(e).__name__}: {e}") from None
+
+
+class LineBatcher:
+    """
+    Collects handwritten line crops from concurrent requests and runs them
+    through TrOCR together: a batch is flushed once it holds max_lines crops
+    or the oldest request has waited max_wait seconds.
+    """
+
+    def __init__(self, max_lines=32, max_wait=0.02):
+        self.max_lines = max_lines
+        self.max_wait = max_wait
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        # the model lives in this process; one thread so batches don't compete for torch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trocr')
+        self.batches = 0
+        self.lines = 0
+
+    async def recognize(self, crops):
+        if not crops:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((crops, future))
+        self._wakeup.set()
+        return await future
+
+    def _pending_lines(self):
+        return sum(len(crops) for crops, _ in self._pending)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+
+            # give other requests a moment to join the batch
+            deadline = loop.time() + self.max_wait
+            while self._pending_lines() < self.max_lines and loop.time() < deadline:
+                await asyncio.sleep(min(0.002, max(deadline - loop.time(), 0)))
+
+            batch, self._pending = self._pending, []
+            pages = [crops for crops, _ in batch]
+            try:
+                texts = await loop.run_in_executor(
+                    self._executor, lambda: backend.get_trocr_engine().recognize_pages(pages))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.lines += sum(len(crops) for crops in pages)
+            for (_, future), lines in zip(batch, texts):
+                if not future.done():
+                    future.set_result(lines)
+
+
+class OCRService:
+    def __init__(self, workers, queue_size, request_timeout, batch_lines, batch_wait):
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        self.batcher = LineBatcher(batch_lines, batch_wait)
+        self.counters = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    async def start(self):
+        # one dispatcher per pool process: at most `workers` jobs in flight, the rest wait in the queue
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self.batcher.run()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, data, future = await self.queue.get()
+            try:
+                with instrumentation.span('service_' + kind, bytes=len(data)):
+                    result = await loop.run_in_executor(self.pool, _run_job, kind, data)
+                    if kind == 'handwritten':
+                        crops = result
+                        lines = await self.batcher.recognize(crops)
+                        result = {'text': "\n".join(lines) if lines else "No handwriting detected.",
+                                  'lines': lines}
+                    elif kind == 'auto':
+                        try:
+                            texts = await self.batcher.recognize(result['crops'])
+                        except Exception as e:
+                            # same as the in-process cascade: keep tesseract's text for those lines
+                            print(f"[ERROR] Escalation to {backend.CASCADE_ESCALATION_ENGINE} failed: {e}")
+                            texts = []
+                        escalated = len(result['escalate'])
+                        result = {'text': backend.merge_cascade(result['lines'], result['escalate'], texts),
+                                  'lines': len(result['lines']), 'escalated': escalated}
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def submit(self, kind, data):
+        """Queue a job and wait for it. Raises asyncio.QueueFull when the service is saturated."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((kind, data, future))
+        self.counters['accepted'] += 1
+        return await asyncio.wait_for(future, self.request_timeout)
+
+    def status(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'workers': self.workers,
+            'trocr_batches': self.batcher.batches,
+            'trocr_lines': self.batcher.lines,
+            'cascade': backend.engine_stats().get('cascade', {}),
+            **self.counters,
+        }
+
+    async def handle(self, method, path, body):
+        """Route one request. Returns (status, payload, extra headers)."""
+        if path == '/health':
+            return 200, {'status': 'ok'}, {}
+        if path == '/status':
+            return 200, self.status(), {}
+        if not path.startswith('/ocr/'):
+            return 404, {'error': 'not found'}, {}
+
+        kind = path[len('/ocr/'):]
+        if kind not in JOBS:
+            return 404, {'error': f"unknown OCR mode '{kind}'"}, {}
+        if method != 'POST':
+            return 405, {'error': 'use POST with the image as the request body'}, {}
+        if not body:
+            return 400, {'error': 'empty request body'}, {}
+
+        start = time.perf_counter()
+        try:
+            result = await self.submit(kind, body)
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            return 503, {'error': 'server busy, retry later'}, {'Retry-After': '1'}
+        except asyncio.TimeoutError:
+            self.counters['failed'] += 1
+            return 504, {'error': 'OCR timed out'}, {}
+        except ValueError as e:
+            self.counters['failed'] += 1
+            return 400, {'error': str(e)}, {}
+        except JobError as e:
+            self.counters['failed'] += 1
+            return 500, {'error': str(e)}, {}
+        except Exception as e:
+            self.counters['failed'] += 1
+            return 500, {'error': f"{type(e).__name__}: {e}"}, {}
+
+        self.counters['completed'] += 1
+        result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        return 200, result, {}
+
+    async def serve_client(self, reader, writer):
+        try:
+            try:
+                status, payload, headers = await self._read_and_handle(reader)
+            except asyncio.LimitOverrunError:
+                # request head longer than the stream buffer limit
+                status, payload, headers = 431, {'error': 'request header too large'}, {}
+            except asyncio.IncompleteReadError:
+                # the client closed before sending the whole head or body
+                status, payload, headers = 400, {'error': 'incomplete request'}, {}
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                    "Content-Type: application/json; charset=utf-8",
+                    f"Content-Length: {len(body)}",
+                    "Connection: close"]
+            head += [f"{name}: {value}" for name, value in headers.items()]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+            if status == 431:
+                # the rest of the head is still unread; closing on it would reset the
+                # connection before the client reads the reply, so drain it briefly first
+                writer.write_eof()
+                await asyncio.wait_for(self._discard(reader), LINGER_SECONDS)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _discard(reader):
+        while await reader.read(1 << 16):
+            pass
+
+    async def _read_and_handle(self, reader):
+        request_head = await reader.readuntil(b"\r\n\r\n")
+        lines = request_head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return 400, {'error': 'malformed request line'}, {}
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {'error': 'invalid Content-Length'}, {}
+        if length > MAX_BODY_BYTES:
+            return 413, {'error': f"image larger than {MAX_BODY_BYTES} bytes"}, {}
+        body = await reader.readexactly(length) if length else b''
+        return await self.handle(method.upper(), target.split('?', 1)[0], body)
+
+
+async def serve(args):
+    service = OCRService(args.workers, args.queue_size, args.timeout, args.batch_lines, args.batch_wait_ms / 1000)
+    await service.start()
+    server = await asyncio.start_server(service.serve_client, args.host, args.port)
+    print(f"OCR service listening on http://{args.host}:{args.port} "
+          f"({args.workers} workers, queue {args.queue_size})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP OCR service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="OCR worker processes")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="requests allowed to wait before answering 503")
+    parser.add_argument('--timeout', type=float, default=120.0, help="per request timeout in seconds")
+    parser.add_argument('--batch-lines', type=int, default=32,
+                        help="handwritten line crops per TrOCR batch")
+    parser.add_argument('--batch-wait-ms', type=float, default=20.0,
+                        help="how long a handwritten batch waits for more requests")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import cv2
-import pytesseract
 import numpy as np
-import pandas as pd
+from backend import get_ocr_engine, load_image
+from ocr_cache import hash_array
+from instrumentation import span
 
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# cells with less ink than this (share of the cell's pixels, rulings excluded) are blank
+EMPTY_CELL_INK_RATIO = 0.002
+# pixels trimmed off every cell side before measuring ink, the border rulings bleed in
+CELL_INSET = 3
+TABLE_OCR_WORKERS = int(os.environ.get('TABLE_OCR_WORKERS', '0')) or min(8, os.cpu_count() or 1)
 
-def extract_tables_from_image(image_path):
-    image = cv2.imread(image_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+_cell_pool = None
+_cell_pool_lock = threading.Lock()
+
+def _get_cell_pool():
+    # one pool for the whole process: its threads keep their tesserocr handles between calls
+    global _cell_pool
+    if _cell_pool is None:
+        with _cell_pool_lock:
+            if _cell_pool is None:
+                _cell_pool = ThreadPoolExecutor(max_workers=TABLE_OCR_WORKERS, thread_name_prefix='table-ocr')
+    return _cell_pool
+
+def extract_tables_from_image(image_path, progress=None):
+    """
+    OCR every table cell found in the image. progress, if given, is called as
+    progress(cells_done, cells_total) as cells finish; raising from it stops
+    the extraction.
+
+    Blank cells are recognised from the ink mask and skipped, cells with
+    identical pixels are OCR'd once, and the rest run on a shared pool of
+    TABLE_OCR_WORKERS threads (tesseract releases the GIL). cells_data keeps the order of the boxes.
+    """
+    image = load_image(image_path)
+    with span('table_detect', height=image.shape[0], width=image.shape[1]) as sp:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        detect_horizontal, detect_vertical = _table_masks(gray)
+
+        table_mask = cv2.add(detect_horizontal, detect_vertical)
+
+        contours, _ = cv2.findContours(table_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        sp.set(contours=len(contours))
+
+    with span('table_cell_ocr') as sp:
+        boxes = [cv2.boundingRect(cnt) for cnt in contours]
+        boxes = [(x, y, w, h) for x, y, w, h in boxes if w >= 50 and h >= 20]
+        texts = [''] * len(boxes)
+
+        # cell ink without the rulings, summed through an integral image: O(1) per cell
+        _, binary = cv2.threshold(~gray, 150, 255, cv2.THRESH_BINARY)
+        ink = cv2.integral((cv2.subtract(binary, table_mask) > 0).view(np.uint8))
+
+        # identical crops (repeated headers, separators) share one OCR call
+        jobs = {}
+        for i, box in enumerate(boxes):
+            if _cell_ink_ratio(ink, box) < EMPTY_CELL_INK_RATIO:
+                continue
+            x, y, w, h = box
+            cell_gray = gray[y:y+h, x:x+w]
+            jobs.setdefault(hash_array(cell_gray), (cell_gray, []))[1].append(i)
+
+        done = len(boxes) - sum(len(ids) for _, ids in jobs.values())
+        sp.set(cells=len(boxes), empty=done, ocr_calls=len(jobs))
+        if progress is not None and done:
+            progress(done, len(boxes))
+
+        engine = get_ocr_engine()
+        pool = _get_cell_pool()
+        futures = {pool.submit(_ocr_cell, engine, cell_gray): ids for cell_gray, ids in jobs.values()}
+        try:
+            for future in as_completed(futures):
+                text = future.result()
+                for i in futures[future]:
+                    texts[i] = text
+                done += len(futures[future])
+                if progress is not None:
+                    progress(done, len(boxes))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    cells_data = [((x, y), text) for (x, y, _, _), text in zip(boxes, texts)]
+    return image, cells_data
+
+def _cell_ink_ratio(ink, box):
+    x, y, w, h = box
+    inset = min(CELL_INSET, (w - 1) // 2, (h - 1) // 2)
+    x0, y0, x1, y1 = x + inset, y + inset, x + w - inset, y + h - inset
+    total = int(ink[y1, x1]) - int(ink[y0, x1]) - int(ink[y1, x0]) + int(ink[y0, x0])
+    return total / ((x1 - x0) * (y1 - y0))
+
+def _ocr_cell(engine, cell_gray):
+    return engine.image_to_string(cell_gray, config='--psm 6').strip()
+
+# whole-page OCR for the single pass mode, sparse text suits scattered cell contents
+TABLE_PAGE_CONFIG = '--psm 11'
+
+def _table_masks(gray):
     _, binary = cv2.threshold(~gray, 150, 255, cv2.THRESH_BINARY)
 
     horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (40, 1))
@@ -15,39 +108,110 @@ def extract_tables_from_image(image_path):
 
     detect_horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horizontal_kernel, iterations=2)
     detect_vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, vertical_kernel, iterations=2)
+    return detect_horizontal, detect_vertical
 
-    table_mask = cv2.add(detect_horizontal, detect_vertical)
+def _line_positions(mask, axis, min_length=40, merge_gap=3):
+    """
+    Centre coordinates of the ruling lines in a line mask. Projects the mask on
+    one axis and merges runs of neighbouring rows/columns (thick lines).
+    """
+    profile = np.count_nonzero(mask, axis=axis)
+    hits = np.flatnonzero(profile >= min_length)
+    if hits.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(hits) > merge_gap)
+    starts = np.concatenate(([hits[0]], hits[breaks + 1]))
+    ends = np.concatenate((hits[breaks], [hits[-1]]))
+    return [int(v) for v in (starts + ends) // 2]
 
-    contours, _ = cv2.findContours(table_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cells_data = []
+def detect_table_grid(gray):
+    """Row edges (y), column edges (x) and the combined line mask of the table grid."""
+    detect_horizontal, detect_vertical = _table_masks(gray)
+    row_edges = _line_positions(detect_horizontal, axis=1)
+    col_edges = _line_positions(detect_vertical, axis=0)
+    return row_edges, col_edges, cv2.add(detect_horizontal, detect_vertical)
 
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        if w < 50 or h < 20:
-            continue
+def _cell_text(words):
+    # reading order inside a cell: group into text lines by top, then left to right
+    words = sorted(words, key=lambda w: w['top'])
+    lines = []
+    for word in words:
+        if lines and word['top'] - lines[-1][0]['top'] < max(word['height'], lines[-1][0]['height']) / 2:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return "\n".join(" ".join(w['text'] for w in sorted(line, key=lambda w: w['left'])) for line in lines)
 
-        cell_img = image[y:y+h, x:x+w]
-        cell_gray = cv2.cvtColor(cell_img, cv2.COLOR_BGR2GRAY)
-        text = pytesseract.image_to_string(cell_gray, config='--psm 6').strip()
-        cells_data.append(((x, y), text))
+def extract_table_grid(image_path):
+    """
+    Single pass table extraction: the page is OCR'd once for word boxes and
+    every word is placed in the grid cell that holds its centre.
+    Returns (image, rows) where rows is a list of lists of cell text.
+    """
+    image = load_image(image_path)
+    with span('table_detect', height=image.shape[0], width=image.shape[1]) as sp:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        row_edges, col_edges, table_mask = detect_table_grid(gray)
+        sp.set(rows=max(len(row_edges) - 1, 0), cols=max(len(col_edges) - 1, 0))
+    if len(row_edges) < 2 or len(col_edges) < 2:
+        return image, []
 
-    return image, cells_data
+    # white out the ruling lines so tesseract doesn't read them as | and _
+    page = gray.copy()
+    page[table_mask > 0] = 255
+    with span('table_page_ocr') as sp:
+        words = get_ocr_engine().image_to_data(page, config=TABLE_PAGE_CONFIG)
+        sp.set(words=len(words))
+
+    n_rows, n_cols = len(row_edges) - 1, len(col_edges) - 1
+    cells = [[[] for _ in range(n_cols)] for _ in range(n_rows)]
+    for word in words:
+        cx = word['left'] + word['width'] / 2
+        cy = word['top'] + word['height'] / 2
+        row = int(np.searchsorted(row_edges, cy)) - 1
+        col = int(np.searchsorted(col_edges, cx)) - 1
+        if 0 <= row < n_rows and 0 <= col < n_cols:
+            cells[row][col].append(word)
+
+    rows = [[_cell_text(cell) for cell in row] for row in cells]
+    return image, rows
+
+def rows_to_csv(rows, output_csv="table.csv"):
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    df.to_csv(output_csv, index=False)
+
+# a cell's box starts on its top ruling, a few pixels above that ruling's centre
+ROW_EDGE_SLACK = 5
+
+def cells_to_rows(cells_data, row_edges=None, row_tolerance=20):
+    """
+    Group ((x, y), text) cells into rows of text, left to right. With
+    row_edges (from detect_table_grid) a cell goes in the grid row its top
+    left corner falls in; without them, cells within row_tolerance pixels of
+    the previous cell's y share a row.
+    """
+    cells_data = sorted(cells_data, key=lambda k: (k[0][1], k[0][0]))
+    if row_edges is not None and len(row_edges) >= 2:
+        rows = [[] for _ in range(len(row_edges) - 1)]
+        for (x, y), text in cells_data:
+            row = int(np.searchsorted(row_edges, y + ROW_EDGE_SLACK, side='right')) - 1
+            rows[min(max(row, 0), len(rows) - 1)].append((x, text))
+        return [[text for _, text in sorted(row)] for row in rows if row]
 
-def cells_to_csv(cells_data, output_csv="table.csv"):
-    cells_data.sort(key=lambda k: (k[0][1], k[0][0]))
     rows = []
     current_row = []
     last_y = None
-
     for (x, y), text in cells_data:
-        if last_y is None or abs(y - last_y) < 20:
+        if last_y is None or abs(y - last_y) < row_tolerance:
             current_row.append(text)
         else:
             rows.append(current_row)
             current_row = [text]
         last_y = y
-    rows.append(current_row)
+    if current_row:
+        rows.append(current_row)
+    return rows
 
-    df = pd.DataFrame(rows)
-    df.to_csv(output_csv, index=False) 
- 
\ No newline at end of file
+def cells_to_csv(cells_data, output_csv="table.csv", row_edges=None):
+    rows_to_csv(cells_to_rows(cells_data, row_edges), output_csv)
@@ -1,154 +1,355 @@
 import os
-import numpy as np
-import pandas as pd
-import seaborn as sns
-from backend import extract_text, preprocess_image
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from backend import (extract_text, preprocess_image, preprocess_adaptive, file_cache_key,
+                     tesseract_version, TESSERACT_CONFIG, PREPROCESS_PARAMS, ADAPTIVE_PARAMS)
+from ocr_cache import get_cache, make_key
+from metrics import MetricsAccumulator
+from results_store import build_columns, save_run
+from dataset import Dataset, parse_shard
+from error_report import char_label, write_confusion_png, write_html_report
 from tqdm import tqdm
-from sklearn.metrics import precision_score, recall_score, f1_score, confusion_matrix
-import matplotlib
-import matplotlib.pyplot as plt
-
-# Set matplotlib backend
-matplotlib.use('TkAgg')
 
 # Dataset paths
 img_dir = 'dataset/img'
 gt_dir = 'dataset/text'
 
-# File list
-image_files = sorted([f for f in os.listdir(img_dir) if f.endswith(('.jpg', '.png', '.jpeg'))])
-total = len(image_files)
-print(f"Total images: {total}")
-
-# Evaluation stats
-correct_words = 0
-total_chars = 0
-correct_chars = 0
-lev_dist_sum = 0
-y_true_chars = []
-y_pred_chars = []
-
-# Additional metrics
-lev_distances = []
-word_lengths = []
-is_correct = []
-wrong_predictions = []  # To store details of incorrect predictions
-
-for img_file in tqdm(image_files, total=total):
-    img_path = os.path.join(img_dir, img_file)
-    file_id = os.path.splitext(img_file)[0]
-    gt_path = os.path.join(gt_dir, f"{file_id}.txt")
-
-    if not os.path.exists(gt_path):
-        print(f"Missing ground truth for: {img_file}")
-        continue
-
-    with open(gt_path, 'r', encoding='utf-8') as f:
-        gt = f.read().strip().lower()
-
-    _, processed, _ = preprocess_image(img_path)
+# Per-image results are appended here as each image finishes, so a run can resume
+default_results_path = 'eval_results.jsonl'
+# Static error analysis (top confusions, per-character scores), viewable without a display
+default_html_path = 'eval_report.html'
+# The finished run (predictions, timings, per-image metrics) in columnar form, see results_store.py
+default_store_path = 'eval_run.npz'
+
+
+def evaluate_image(entry, adaptive=False, image=None):
+    """
+    Preprocess + OCR one dataset manifest entry. Runs inside the worker
+    processes, so it only returns a plain dict (no printing, no metric state).
+    image is the already decoded page when the caller prefetched it.
+    adaptive=True uses the adaptive preprocessing planner and records the
+    stages it ran.
+    """
+    img_file = entry['filename']
+    img_path = entry['image_path']
+
+    # the ground truth comes from the manifest, no per-image file reads here
+    if not entry['has_gt']:
+        return {'filename': img_file, 'status': 'missing_gt'}
+    gt = entry['ground_truth'].lower()
+
+    # same image + same pipeline settings -> reuse the earlier OCR output
+    # the file is hashed once, the same key serves the lookup and the store
+    cache = get_cache()
+    key = file_cache_key(img_path, adaptive)
+    cached = cache.get(key) if key else None
+    if cached is not None:
+        return {
+            'filename': img_file,
+            'status': 'ok',
+            'predicted': cached.strip().lower(),
+            'ground_truth': gt,
+            'timings': {'preprocess': 0.0, 'ocr': 0.0},
+            'cached': True,
+        }
+
+    start = time.perf_counter()
+    plan = None
+    source = image if image is not None else img_path
+    if adaptive:
+        _, processed, _, plan = preprocess_adaptive(source)
+    else:
+        _, processed, _ = preprocess_image(source)
+    preprocess_time = time.perf_counter() - start
     if processed is None:
-        print(f"Failed to process image: {img_file}")
-        continue
+        return {'filename': img_file, 'status': 'failed'}
+
+    start = time.perf_counter()
+    try:
+        text = extract_text(processed, use_cache=False, raise_errors=True)
+    except Exception as e:
+        # not cached and not written to the results file, so a later run retries it
+        return {'filename': img_file, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+    ocr_time = time.perf_counter() - start
+    if key:
+        cache.put(key, text)
+    pred = text.strip().lower()
+
+    record = {
+        'filename': img_file,
+        'status': 'ok',
+        'predicted': pred,
+        'ground_truth': gt,
+        'timings': {'preprocess': preprocess_time, 'ocr': ocr_time},
+    }
+    if plan is not None:
+        record['stages'] = plan['stages']
+        record['scale'] = plan['scale']
+    return record
+
+
+def pipeline_id(adaptive=False):
+    """Fingerprint of the settings a prediction depends on, stored in every result record."""
+    if adaptive:
+        return make_key('pipeline', PREPROCESS_PARAMS, ADAPTIVE_PARAMS, TESSERACT_CONFIG, tesseract_version())
+    return make_key('pipeline', PREPROCESS_PARAMS, TESSERACT_CONFIG, tesseract_version())
+
+
+def load_results(results_path, pipeline=None):
+    """
+    {filename: record} from a results file. With pipeline, records made with
+    other settings (another mode, Tesseract config or version) are left out,
+    so resuming never mixes predictions from two configurations.
+    """
+    # a run killed mid-write can leave a truncated last line, just skip it
+    results = {}
+    if not os.path.exists(results_path):
+        return results
+    stale = 0
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if pipeline is not None and record.get('pipeline') != pipeline:
+                stale += 1
+                continue
+            results[record['filename']] = record
+    if stale:
+        print(f"Ignoring {stale} records in {results_path} made with other settings")
+    return results
+
+
+def _init_worker():
+    # every worker already is one "core", don't let tesseract spawn its own threads on top
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def run_batch(dataset, entries, results_path, workers, adaptive=False, prefetch=8):
+    """
+    OCR every entry that is not already in results_path and append its record
+    to the file as soon as it finishes. Returns {filename: record}.
+    """
+    pipeline = pipeline_id(adaptive)
+    results = load_results(results_path, pipeline)
+    pending = [e for e in entries if e['filename'] not in results]
+    if len(pending) < len(entries):
+        print(f"Resuming: {len(entries) - len(pending)} images already done, {len(pending)} left")
+
+    with open(results_path, 'a', encoding='utf-8') as out:
+        def record_result(record):
+            record['pipeline'] = pipeline
+            if record['status'] == 'ok':
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            results[record['filename']] = record
+
+        if workers <= 1:
+            # the next images are decoded in the background while this one is OCR'd
+            for entry, image in tqdm(dataset.iter_images(pending, prefetch), total=len(pending)):
+                record_result(evaluate_image(entry, adaptive, image))
+        else:
+            # every worker decodes its own images, overlapping with the other workers' OCR
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(evaluate_image, entry, adaptive) for entry in pending]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    record_result(future.result())
+
+    cache = get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"OCR cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+
+    return results
+
+
+def _has_display():
+    return not sys.platform.startswith('linux') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
 
-    pred = extract_text(processed).strip().lower()
+def report(image_files, results, plot=True, plot_path=None, html_path=default_html_path, stats=None):
+    """stats: a MetricsAccumulator already fed with these results (see build_columns), else they are scored here."""
 
-    print("Predicted: ", pred)
-    print("Actual: ", gt)
+    # Evaluation stats, constant memory however many pages are scored
+    scored = stats is not None
+    if not scored:
+        stats = MetricsAccumulator()
 
-    # Word-level accuracy
-    word_correct = pred == gt
-    if word_correct:
-        correct_words += 1
+    wrong_predictions = []  # To store details of incorrect predictions
+    preprocess_times = []
+    ocr_times = []
+    stage_plans = {}  # adaptive runs: how many images took each stage combination
+
+    # walk in file order (not completion order) so the output matches a serial run
+    for img_file in image_files:
+        record = results.get(img_file)
+        if record is None:
+            continue
+        if record['status'] == 'missing_gt':
+            print(f"Missing ground truth for: {img_file}")
+            continue
+        if record['status'] == 'failed':
+            print(f"Failed to process image: {img_file}" + (f" ({record['error']})" if 'error' in record else ""))
+            continue
+
+        pred = record['predicted']
+        gt = record['ground_truth']
+
+        print("Predicted: ", pred)
+        print("Actual: ", gt)
+
+        # Character-level stats, all from one alignment of pred against gt
+        if not scored:
+            stats.update(pred, gt)
+
+        # Word-level accuracy
+        word_correct = pred == gt
+        if not word_correct:
+            wrong_predictions.append({
+                'filename': img_file,
+                'predicted': pred,
+                'ground_truth': gt
+            })
+
+        # cache hits didn't run the pipeline, keep them out of the latency numbers
+        if not record.get('cached'):
+            preprocess_times.append(record['timings']['preprocess'])
+            ocr_times.append(record['timings']['ocr'])
+        if 'stages' in record:
+            plan = ' -> '.join(record['stages'])
+            stage_plans[plan] = stage_plans.get(plan, 0) + 1
+
+    # Final calculations, over the scored images only: images without ground truth would count as wrong
+    total = stats.images
+    word_accuracy = (stats.correct_words / total) * 100 if total > 0 else 0
+    char_accuracy = (stats.correct_chars / stats.total_chars) * 100 if stats.total_chars > 0 else 0
+    avg_lev_distance = stats.edit_distance / total if total > 0 else 0
+    cer = (stats.edit_distance / stats.total_chars) * 100 if stats.total_chars > 0 else 0
+    wer = (stats.word_errors / stats.total_words) * 100 if stats.total_words > 0 else 0
+
+    # Precision, Recall, F1 (micro averaged over the aligned character pairs)
+    precision = recall = f1 = stats.micro_precision
+    # all per-character scores come from the same sparse confusion counts
+    char_scores = stats.per_char_scores()
+    seen = char_scores['support'] > 0
+    macro_f1 = char_scores['f1'][seen].mean() if seen.any() else 0.0
+
+    # Print metrics
+    print("\n📊 OCR Evaluation Metrics:")
+    print(f"✅ Word-Level Accuracy:     {word_accuracy:.2f}%")
+    print(f"🔠 Character-Level Accuracy: {char_accuracy:.2f}%")
+    print(f"✏ Avg Levenshtein Distance: {avg_lev_distance:.2f}")
+    print(f"🔡 Character Error Rate:    {cer:.2f}%")
+    print(f"🔤 Word Error Rate:         {wer:.2f}%")
+    print(f"🎯 Precision:                {precision:.4f}")
+    print(f"📈 Recall:                   {recall:.4f}")
+    print(f"🏆 F1 Score:                 {f1:.4f}")
+    print(f"🧮 Macro F1 (per char):      {macro_f1:.4f}")
+
+    # Latency, so preprocessing changes can be checked for speed as well as accuracy
+    if preprocess_times:
+        print(f"⏱ Avg Preprocess Time:      {sum(preprocess_times) / len(preprocess_times) * 1000:.2f} ms "
+              f"({len(preprocess_times)} uncached images)")
+        print(f"⏱ Avg OCR Time:             {sum(ocr_times) / len(ocr_times) * 1000:.2f} ms")
+    for plan, count in sorted(stage_plans.items(), key=lambda item: -item[1]):
+        print(f"🧭 Stages {plan}: {count} images")
+
+    # Print detailed wrong predictions
+    if wrong_predictions:
+        print("\n❌ Incorrect Predictions:")
+        for item in wrong_predictions:
+            print(f"\n🖼️ Image: {item['filename']}")
+            print(f"🔮 Predicted:     {item['predicted']}")
+            print(f"📌 Ground Truth:  {item['ground_truth']}")
     else:
-        wrong_predictions.append({
-            'filename': img_file,
-            'predicted': pred,
-            'ground_truth': gt
-        })
-
-    # Character-level stats
-    correct_chars += sum(p == g for p, g in zip(pred, gt))
-    total_chars += len(gt)
-
-    # Levenshtein distance
-    def levenshtein_distance(s1, s2):
-        len_s1, len_s2 = len(s1), len(s2)
-        dp = np.zeros((len_s1 + 1, len_s2 + 1), dtype=int)
-        for i in range(len_s1 + 1):
-            dp[i][0] = i
-        for j in range(len_s2 + 1):
-            dp[0][j] = j
-        for i in range(1, len_s1 + 1):
-            for j in range(1, len_s2 + 1):
-                cost = 0 if s1[i - 1] == s2[j - 1] else 1
-                dp[i][j] = min(dp[i - 1][j] + 1,
-                               dp[i][j - 1] + 1,
-                               dp[i - 1][j - 1] + cost)
-        return dp[len_s1][len_s2]
-
-    lev_dist = levenshtein_distance(pred, gt)
-    lev_dist_sum += lev_dist
-    lev_distances.append(lev_dist)
-
-    # Pad strings
-    max_len = max(len(gt), len(pred))
-    gt_padded = gt.ljust(max_len)
-    pred_padded = pred.ljust(max_len)
-
-    y_true_chars.extend(list(gt_padded))
-    y_pred_chars.extend(list(pred_padded))
-
-    # Word length stats
-    word_lengths.append(len(gt))
-    is_correct.append(1 if word_correct else 0)
-
-# Clean padding-only characters
-filtered = [(t, p) for t, p in zip(y_true_chars, y_pred_chars) if t.strip() != '' or p.strip() != '']
-y_true_chars, y_pred_chars = zip(*filtered) if filtered else ([], [])
-
-# Final calculations
-word_accuracy = (correct_words / total) * 100
-char_accuracy = (correct_chars / total_chars) * 100 if total_chars > 0 else 0
-avg_lev_distance = lev_dist_sum / total if total > 0 else 0
-
-# Precision, Recall, F1
-precision = precision_score(y_true_chars, y_pred_chars, average='micro', zero_division=0)
-recall = recall_score(y_true_chars, y_pred_chars, average='micro', zero_division=0)
-f1 = f1_score(y_true_chars, y_pred_chars, average='micro', zero_division=0)
-
-# Print metrics
-print("\n📊 OCR Evaluation Metrics:")
-print(f"✅ Word-Level Accuracy:     {word_accuracy:.2f}%")
-print(f"🔠 Character-Level Accuracy: {char_accuracy:.2f}%")
-print(f"✏ Avg Levenshtein Distance: {avg_lev_distance:.2f}")
-print(f"🎯 Precision:                {precision:.4f}")
-print(f"📈 Recall:                   {recall:.4f}")
-print(f"🏆 F1 Score:                 {f1:.4f}")
-
-# Print detailed wrong predictions
-if wrong_predictions:
-    print("\n❌ Incorrect Predictions:")
-    for item in wrong_predictions:
-        print(f"\n🖼️ Image: {item['filename']}")
-        print(f"🔮 Predicted:     {item['predicted']}")
-        print(f"📌 Ground Truth:  {item['ground_truth']}")
-else:
-    print("\n✅ All predictions were correct!")
-
-# Character Confusion Matrix
-if len(set(y_true_chars)) <= 100:
-    chars = sorted(set(y_true_chars))
-    cm = confusion_matrix(y_true_chars, y_pred_chars, labels=chars)
-
-    plt.figure(figsize=(12, 8))
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
-                xticklabels=chars, yticklabels=chars,
-                cbar_kws={'label': 'Number of Errors'})
-    plt.title('Character Confusion Matrix', fontweight='bold')
-    plt.xlabel('Predicted Characters')
-    plt.ylabel('True Characters')
-    plt.xticks(rotation=45)
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    plt.show()
+        print("\n✅ All predictions were correct!")
+
+    top = stats.top_confusions(10)
+    if top:
+        print("\n🔁 Most Frequent Confusions (∅ = missing / extra character):")
+        for true_char, pred_char, count in top:
+            print(f"   {char_label(true_char)} -> {char_label(pred_char)}: {count}")
+
+    write_html_report(stats, html_path)
+    print(f"\n📄 Error report saved to {html_path}")
+
+    # Character Confusion Matrix, of the most error-prone characters
+    if plot and stats.char_pairs:
+        if plot_path is None and not _has_display():
+            plot_path = 'confusion_matrix.png'
+        try:
+            write_confusion_png(stats, plot_path)
+        except ImportError:
+            print("matplotlib is not installed, skipping the confusion matrix plot (see the HTML report)")
+        else:
+            if plot_path:
+                print(f"Confusion matrix saved to {plot_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the OCR pipeline on dataset/img")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of OCR worker processes (1 = run serially in this process)")
+    parser.add_argument('--results', default=default_results_path,
+                        help="per-image results file, reused to resume an interrupted run")
+    parser.add_argument('--fresh', action='store_true',
+                        help="discard previous results and OCR every image again")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the on-disk OCR cache")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="use the adaptive preprocessing planner (use a separate --results file to compare)")
+    parser.add_argument('--plot', metavar='PNG',
+                        help="write the confusion matrix to this file instead of opening a window")
+    parser.add_argument('--no-plot', action='store_true', help="skip the confusion matrix plot")
+    parser.add_argument('--html', default=default_html_path,
+                        help="static HTML error report (top confusions, per-character P/R/F1)")
+    parser.add_argument('--store', default=default_store_path,
+                        help="save the run as a columnar .npz for results_store.py rescore / diff")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="only evaluate shard I of N (e.g. 0/4), for runs split across machines")
+    parser.add_argument('--limit', type=int, help="evaluate at most this many images")
+    parser.add_argument('--include-empty-gt', action='store_true',
+                        help="score images whose ground truth file is empty (skipped by default)")
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help="images decoded ahead in the background when --workers 1")
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help="re-read every ground truth file and image header instead of the cached manifest")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        os.environ['OCR_CACHE'] = '0'
+
+    # File list, from the cached dataset manifest
+    dataset = Dataset(img_dir, gt_dir, rebuild=args.rebuild_index)
+    info = dataset.stats()
+    print(f"Total images: {info['images']} ({info['missing_gt']} without ground truth, "
+          f"{info['empty_gt']} with empty ground truth)")
+    entries = dataset.select(skip_empty_gt=not args.include_empty_gt, shard=args.shard, limit=args.limit)
+    image_files = [entry['filename'] for entry in entries]
+    if len(entries) != info['images']:
+        print(f"Evaluating {len(entries)} images")
+
+    if args.fresh and os.path.exists(args.results):
+        os.remove(args.results)
+
+    results = run_batch(dataset, entries, args.results, args.workers, args.adaptive, args.prefetch)
+
+    # every image is aligned once, for the stored columns and the report alike
+    records = [results[f] for f in image_files if f in results]
+    stats = MetricsAccumulator()
+    save_run(args.store, build_columns(records, stats), {
+        'tesseract_config': TESSERACT_CONFIG,
+        'preprocess_params': PREPROCESS_PARAMS,
+        'adaptive': args.adaptive,
+        'ocr_engine': tesseract_version(),
+    })
+    print(f"Run saved to {args.store}")
+    report(image_files, results, plot=not args.no_plot, plot_path=args.plot, html_path=args.html, stats=stats)
+
+
+if __name__ == '__main__':
+    main()